@@ -0,0 +1,130 @@
+# Time the stages of the BG to CellML conversion on synthetic networks (see networks.py) and write the results as JSON
+# e.g., python benchmark/bench.py --kinds cycle multicycle --sizes 4 6 8 --output results.json
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+current = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(1, os.path.join(current, '..', 'src'))
+import numpy as np
+import sympy
+from libcellml import Component, Model, Printer, Variable
+from mathmlBuilder import MathAccumulator
+from utilities import load_matrix
+from BG2CellML import UnitsRegistry, add_BGcomp, add_BGbond, flux_ss, flux_ss_diagram, simplify_flux_ss
+from networks import NETWORKS, generate
+
+""" Build the BG model as read_csvBG"""
+def build_model(name, CompName, CompType, ReName, ReType, N_f, N_r):
+    model = Model(name)
+    component = Component(name)
+    model.addComponent(component)
+    model.addComponent(Component(name + '_param'))
+    units = UnitsRegistry()
+    voi = Variable('t')
+    voi.setUnits(units.get('second'))
+    component.addVariable(voi)
+    math = MathAccumulator()
+    for i, comp in enumerate(CompName):
+        add_BGcomp(model, comp, CompType[i], voi.name(), math, units)
+    for i, re in enumerate(ReName):
+        add_BGcomp(model, re, ReType[i], voi.name(), math, units)
+    add_BGbond(model, list(zip(CompName, CompType)), list(zip(ReName, ReType)), N_f, N_r, math)
+    math.commit(component)
+    return model
+
+""" Run func and time it, the output printed by func is discarded"""
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+""" Time each stage on one network"""
+def bench_network(kind, size, directory, max_size):
+    # input: max_size, {stage: the largest size to run}, the stages beyond it are skipped
+    # output: [dict], one record per stage with the status 'ok', 'skipped' or 'error'
+    file_f, file_r = generate(directory, kind, size)
+    records = []
+    def record(stage, seconds=None, status='ok', **info):
+        records.append({'kind': kind, 'size': size, 'stage': stage, 'seconds': seconds, 'status': status, **info})
+
+    network, seconds = timed(load_matrix, file_f, file_r)
+    CompName, CompType, ReName, ReType, N_f, N_r = network
+    info = {'n_species': len(CompName), 'n_reactions': len(ReName)}
+    record('load_matrix', seconds, **info)
+    stages = [('flux_ss', lambda: flux_ss(*network)),
+              ('flux_ss_fraction_free', lambda: flux_ss(*network, solver='fraction_free')),
+              ('flux_ss_diagram', lambda: flux_ss_diagram(*network))]
+    diagram = None
+    for stage, func in stages:
+        if size > max_size.get(stage, size):
+            record(stage, status='skipped', **info)
+            continue
+        try:
+            result, seconds = timed(func)
+        except Exception as e:
+            record(stage, status='error', error=repr(e), **info)
+            continue
+        if stage == 'flux_ss_diagram':
+            diagram = result
+            n_terms = len(result[1]) # the denominator is a sparse polynomial
+        else:
+            n_terms = len(sympy.Add.make_args(sympy.expand(result[1])))
+        record(stage, seconds, n_terms_den=n_terms, **info)
+    if diagram is None or size > max_size.get('simplify_flux_ss', size):
+        record('simplify_flux_ss', status='skipped', **info)
+    else:
+        try:
+            (v_ss, P, Q), seconds = timed(simplify_flux_ss, *diagram)
+            record('simplify_flux_ss', seconds, n_P=len(P), **info)
+        except Exception as e:
+            record('simplify_flux_ss', status='error', error=repr(e), **info)
+    try:
+        model, seconds = timed(build_model, f'BG_{kind}{size}', *network)
+        record('add_BGcomp_BGbond', seconds, **info)
+    except Exception as e:
+        record('add_BGcomp_BGbond', status='error', error=repr(e), **info)
+        record('print_cellml', status='skipped', **info)
+        return records
+    printed, seconds = timed(Printer().printModel, model)
+    record('print_cellml', seconds, n_bytes=len(printed), **info)
+    return records
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the BG to CellML conversion on synthetic networks.')
+    parser.add_argument('--kinds', nargs='+', default=list(NETWORKS), choices=list(NETWORKS))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[3, 4, 6, 8])
+    parser.add_argument('--max-lu-size', type=int, default=5, help='the largest size of the sympy LU solver (flux_ss)')
+    parser.add_argument('--max-symbolic-size', type=int, default=16, help='the largest size of the symbolic steady state stages')
+    parser.add_argument('--repeat', type=int, default=1, help='run each network several times')
+    parser.add_argument('--directory', default=None, help='where to write the networks, a temporary directory by default')
+    parser.add_argument('--output', default=None, help='the JSON file of the results, stdout by default')
+    args = parser.parse_args(argv)
+    max_size = {'flux_ss': args.max_lu_size, 'flux_ss_fraction_free': args.max_symbolic_size,
+                'flux_ss_diagram': args.max_symbolic_size, 'simplify_flux_ss': args.max_symbolic_size}
+    records = []
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = args.directory or tmp
+        for kind in args.kinds:
+            for size in args.sizes:
+                for run in range(args.repeat):
+                    for rec in bench_network(kind, size, directory, max_size):
+                        rec['run'] = run
+                        records.append(rec)
+                        print(f"{kind}{size} {rec['stage']}: {rec['status']} {rec['seconds']}", file=sys.stderr)
+    results = {'python': platform.python_version(), 'sympy': sympy.__version__, 'numpy': np.__version__,
+               'platform': platform.platform(), 'records': records}
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=1)
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+
+if __name__ == '__main__':
+    main()
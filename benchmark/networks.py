@@ -0,0 +1,73 @@
+# Generate synthetic bond graph networks as stoichiometric csv pairs in the format of load_matrix (src/utilities.py)
+import csv
+import os
+
+""" n-state enzyme cycle E1 -> E2 -> ... -> En -> E1, Ao binds at r1 and Ai is released at r(n/2+1)"""
+def cycle(n):
+    species = [('Ce', f'E{i+1}') for i in range(n)] + [('Se', 'Ao'), ('Se', 'Ai')]
+    reactions = [('Re', f'r{j+1}') for j in range(n)]
+    N_f = {(n, 0): 1}
+    N_r = {(n+1, n//2): 1}
+    for j in range(n):
+        N_f[(j, j)] = 1
+        N_r[((j+1) % n, j)] = 1
+    return species, reactions, N_f, N_r
+
+""" 3-state enzyme cycle E1 -> E2 -> E3 -> E1 with a linear chain E3 <-> C1 <-> ... <-> C(n-3) of dead-end states, n states in all"""
+def chain(n):
+    # output: species, [(CompType, CompName)]; reactions, [(ReType, ReName)]; N_f, N_r, {(species index, reaction index): stoichiometry}
+    # The steady state stages need the total enzyme to be conserved, so the chain branches off a cycle instead of joining two sources
+    if n < 3:
+        raise ValueError('The chain network has at least the 3 states of its cycle')
+    species, reactions, N_f, N_r = cycle(3)
+    for k in range(n-3):
+        species.insert(3+k, ('Ce', f'C{k+1}'))
+    # the sources Ao and Ai are after the n states
+    N_f = {(i if i < 3 else i+n-3, j): s for (i, j), s in N_f.items()}
+    N_r = {(i if i < 3 else i+n-3, j): s for (i, j), s in N_r.items()}
+    for k in range(n-3):
+        j = len(reactions)
+        reactions.append(('Re', f'r{j+1}'))
+        N_f[(2+k, j)] = 1
+        N_r[(3+k, j)] = 1
+    return species, reactions, N_f, N_r
+
+""" n-state cycle with n_cycles-1 extra reactions E1 -> E(2k+1), i.e., a transporter with several cycles (slippage)"""
+def multicycle(n, n_cycles=2):
+    species, reactions, N_f, N_r = cycle(n)
+    for k in range(1, n_cycles):
+        j = len(reactions)
+        reactions.append(('Re', f'r{j+1}'))
+        N_f[(0, j)] = 1
+        N_r[((2*k) % n, j)] = 1
+    return species, reactions, N_f, N_r
+
+""" n-state cycle where the charge zm crosses the membrane at r2, i.e., an electrogenic transporter with a Ve species"""
+def electrogenic(n):
+    species, reactions, N_f, N_r = cycle(n)
+    species.append(('Ve', 'zm'))
+    N_f[(len(species)-1, 1 % n)] = 1
+    return species, reactions, N_f, N_r
+
+NETWORKS = {'chain': chain, 'cycle': cycle, 'multicycle': multicycle, 'electrogenic': electrogenic}
+
+""" Write the network as the forward and reverse stoichiometric csv files"""
+def write_network(directory, name, species, reactions, N_f, N_r):
+    # output: the paths of {name}_f.csv and {name}_r.csv
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for suffix, N in [('_f', N_f), ('_r', N_r)]:
+        rows = [['', ''] + [re[0] for re in reactions], ['', ''] + [re[1] for re in reactions]]
+        for i, comp in enumerate(species):
+            rows.append([comp[0], comp[1]] + [str(N.get((i, j), 0)) for j in range(len(reactions))])
+        path = os.path.join(directory, name + suffix + '.csv')
+        with open(path, 'w', newline='') as f:
+            csv.writer(f).writerows(rows)
+        paths.append(path)
+    return paths
+
+""" Generate the network of the kind and size and write it to the directory"""
+def generate(directory, kind, size, **kwargs):
+    if kind not in NETWORKS:
+        raise ValueError(f'Network {kind} is not defined!')
+    return write_network(directory, f'{kind}{size}', *NETWORKS[kind](size, **kwargs))
@@ -1,14 +1,33 @@
 from libcellml import Component, Model, Units,  Variable, ImportSource
-from utilities import  ask_for_file_or_folder, ask_for_input, load_matrix, infix_to_mathml
+from utilities import  ask_for_file_or_folder, ask_for_input
+import mathmlBuilder as mml
 import sys
 from pathlib import PurePath
-from build_CellMLV2 import editModel, MATH_FOOTER, MATH_HEADER,addEquations, _defineUnits,parseCellML,writeCellML,writeCellML_UI, importCellML,importCellML_UI
+from build_CellMLV2 import editModel, BUILTIN_UNITS,addEquations, _defineUnits,writeCellML,writeCellML_UI, importCellML,importCellML_UI
 from sympy import *
 import numpy as np
 from itertools import combinations
-import networkx as nx
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import signal
+import threading
+from sparseSolver import solve_fraction_free, exprs_to_ring, det_fraction_free, pack_rows, unpack_rows
+from sympy.polys.rings import PolyElement
+from ssCache import SS_CACHE_DIR, stoich_key, load_ss, save_ss
+from sparseStoich import to_sparse
+from networkCache import load_matrix_cached
+from unitsCache import load_units_library
 
 R,T,V_m, F, E=symbols('R,T,V_m, F, E')
+# Budgets of the symbolic steady state derivation, beyond which the numeric mode is used
+SS_MAX_TERMS = 20000 # the number of directional diagrams (terms of the denominator)
+SS_TIMEOUT = 600 # seconds, None for no time limit
+SS_N_WORKERS = 1 # processes to compute the species weights of the diagram, None for all the cores
+# Wall-clock (seconds, None for no limit) and term-count budgets of the stages of simplify_flux_ss
+SIMPLIFY_BUDGET = {'collect': {'time': 600, 'terms': 100000},
+                   'group': {'time': 60, 'terms': 10000},
+                   'factor': {'time': 60, 'terms': 1000}}
+SS_CSE = False # define the repeated subexpressions of v_ss and P as intermediate variables of the steady state models
 #---------------------------------------------------------------Build a cellML model for BG----------------------------------------------------------#
 """Define BG component class"""
 class BG():
@@ -54,27 +73,49 @@ class BG():
     v_E_1.addUnit(Units.StandardUnit.SECOND, 1, -1)
     # mu_E_1 = Units('volt') # volt is the default unit for effort, so no need to define it
 
+"""One shared Units object per units name of a model"""
+class UnitsRegistry():
+    # The variables only refer to their units by name, so the variables of a model with the same units can share one Units object,
+    # and the number of Units objects is the number of distinct units instead of the number of variables
+    def __init__(self):
+        names = set(BUILTIN_UNITS)
+        names.update(BG.dom[dom][var][1] for dom in BG.dom for var in BG.dom[dom])
+        names.update(BG.comp[comp]['para'][1] for comp in BG.comp)
+        names.update(BG.const[const][1] for const in BG.const)
+        self.units = {name: Units(name) for name in names}
+
+    """ The shared Units of the name, the other names, e.g., the units of the simplified parameters, are added on first use"""
+    def get(self, name):
+        if name not in self.units:
+            self.units[name] = Units(name)
+        return self.units[name]
+
 """Add variables and equations based on the component type"""
-def add_BGcomp(model, name, type, voi = 't'):   
+def add_BGcomp(model, name, type, voi = 't', math = None, units = None):   
+    # input: math, the MathAccumulator (mathmlBuilder.py) of the equations, which are appended to the component directly if None
+    #        units, the UnitsRegistry of the model, a new one if None
     if type not in list(BG.comp):
        sys.exit(f'BG {type} is not defined!')
     component = model.component(model.name())
     component_param = model.component(model.name()+ '_param')
+    appendMath = component.appendMath if math is None else math.append
+    if units is None:
+        units = UnitsRegistry()
     dom = BG.comp[type]['dom']
     para_name = BG.comp[type]['para'][0] + '_' + name
-    para_unit = Units(BG.comp[type]['para'][1])
+    para_unit = units.get(BG.comp[type]['para'][1])
     para=Variable(para_name)
     para.setUnits(para_unit)
     component.addVariable(para)
     component_param.addVariable(para.clone())
     f_name = BG.dom[dom]['f'][0]+ '_' + name
-    f_unit = Units(BG.dom[dom]['f'][1])
+    f_unit = units.get(BG.dom[dom]['f'][1])
     f=Variable(f_name)
     f.setUnits(f_unit)
     component.addVariable(f)
     if type in ['Ce','Se','C','Ve']:          
         q_init_name = BG.dom[dom]['q'][0]+ '_' + name + '_init'
-        q_unit = Units(BG.dom[dom]['q'][1])
+        q_unit = units.get(BG.dom[dom]['q'][1])
         q_init=Variable(q_init_name)
         q_init.setUnits(q_unit)
         component.addVariable(q_init)
@@ -85,40 +126,47 @@ def add_BGcomp(model, name, type, voi = 't'):
         q.setInitialValue(q_init)
         component.addVariable(q)
         e_name = BG.dom[dom]['e'][0]+ '_' + name
-        e_unit = Units(BG.dom[dom]['e'][1])
+        e_unit = units.get(BG.dom[dom]['e'][1])
         e=Variable(e_name)
         e.setUnits(e_unit)
         component.addVariable(e)
         if type in ['Ce','Se']:   
-           eq = f'R*T*ln({para.name()}*{q.name()})'
+           eq = mml.times(mml.ci('R'), mml.ci('T'), mml.ln(mml.times(mml.ci(para.name()), mml.ci(q.name()))))
         else: # 'C','Ve'
-           eq = f'{f.name()}/{para.name()}'
+           eq = mml.divide(mml.ci(f.name()), mml.ci(para.name()))
         ode_var = f'{e.name()}'          
-        component.appendMath(infix_to_mathml(eq, ode_var))
+        appendMath(mml.equation(eq, ode_var))
         if type in ['Ce','C']:
            ode_var = f'{q.name()}'
-           eq = f'{f.name()}'
-           component.appendMath(infix_to_mathml(eq, ode_var, voi))                    
+           eq = mml.ci(f.name())
+           appendMath(mml.equation(eq, ode_var, voi))                    
     elif type == 'Re':
         ein_name = BG.dom[dom]['e'][0]+ '_' + name+ '_in'
         eout_name = BG.dom[dom]['e'][0]+ '_' + name+ '_out'
-        e_unit = Units(BG.dom[dom]['e'][1])
+        e_unit = units.get(BG.dom[dom]['e'][1])
         ein=Variable(ein_name)
         eout=Variable(eout_name)
         ein.setUnits(e_unit)
         eout.setUnits(e_unit)
         component.addVariable(ein)
         component.addVariable(eout)
-        eq = f'{para.name()}*(exp({ein.name()}/(R*T))-exp({eout.name()}/(R*T)))'
+        RT = mml.times(mml.ci('R'), mml.ci('T'))
+        eq = mml.times(mml.ci(para.name()), mml.minus(mml.exponential(mml.divide(mml.ci(ein.name()), RT)), mml.exponential(mml.divide(mml.ci(eout.name()), RT))))
         ode_var = f'{f.name()}'
-        component.appendMath(infix_to_mathml(eq, ode_var))
+        appendMath(mml.equation(eq, ode_var))
     else:
         sys.exit(f'BG {type} is not defined!')
 
 """"Add equations based on the connection matrices"""
-def add_BGbond(model, comps, compd, Nf, Nr):
+def add_BGbond(model, comps, compd, Nf, Nr, math = None):
+    # Nf, Nr: the sparse matrices (SparseStoich, see load_sparse_matrix) or the dense arrays of strings (load_matrix)
+    # math: the MathAccumulator of the equations as add_BGcomp
+    # Only the nonzero cells are visited, so the cost is proportional to the number of nonzeros
+    Nf, Nr = to_sparse(Nf), to_sparse(Nr)
     # Add the zero nodes, i.e., mass balance equations
     component = model.component(model.name())
+    appendMath = component.appendMath if math is None else math.append
+    f_names = [BG.dom[BG.comp[type]['dom']]['f'][0]+ '_' + name for name, type in compd]
     for i,ecomp in enumerate(comps):
         name = ecomp[0]
         type = ecomp[1]
@@ -126,96 +174,56 @@ def add_BGbond(model, comps, compd, Nf, Nr):
         f_name = BG.dom[dom]['f'][0]+ '_' + name
         ode_var = f'{f_name}'
         eq = []
-        for j in range(len(Nf[0,:])):
-            if Nf[i,j] != '0':
-                name = compd[j][0]
-                type = compd[j][1]
-                dom = BG.comp[type]['dom']
-                f_name = BG.dom[dom]['f'][0]+ '_' + name
-                if Nf[i,j] == '1':
-                    eq.append(f'-{f_name}')
-                else:
-                    eq.append(f'-{Nf[i,j]}*{f_name}')
-        for j in range(len(Nr[0,:])):
-            if Nr[i,j] != '0':
-                name = compd[j][0]
-                type = compd[j][1]
-                dom = BG.comp[type]['dom']
-                f_name = BG.dom[dom]['f'][0]+ '_' + name
-                if Nr[i,j] == '1':
-                    if len(eq) == 0:
-                        eq.append(f'{f_name}')
-                    else:
-                        eq.append(f'+{f_name}')
-                else:
-                    if len(eq) == 0:
-                        eq.append(f'{Nr[i,j]}*{f_name}')
-                    else:
-                        eq.append(f'+{Nr[i,j]}*{f_name}')
-                        
-        component.appendMath(infix_to_mathml(''.join(eq), ode_var))
+        for j, cell in zip(*Nf.row_nonzeros(i)):
+            eq.append((-1, _bond_term(cell, f_names[j])))
+        for j, cell in zip(*Nr.row_nonzeros(i)):
+            eq.append((1, _bond_term(cell, f_names[j])))
+        appendMath(mml.equation(mml.signed_sum(eq), ode_var))
     # Add the one nodes, i.e., energy balance equations
+    e_names = [BG.dom[BG.comp[type]['dom']]['e'][0]+ '_' + name for name, type in comps]
     for j,dcomp in enumerate(compd):
         name = dcomp[0]
         type = dcomp[1]
         dom = BG.comp[type]['dom']
         ein_name = BG.dom[dom]['e'][0]+ '_' + name+ '_in'
         eout_name = BG.dom[dom]['e'][0]+ '_' + name+ '_out'
-        eqout = []
-        eqin = []
         ode_var_out = f'{eout_name}'
         ode_var_in = f'{ein_name}'
-        for i in range(len(Nf[:,0])):
-            if Nf[i,j] != '0':
-                name = comps[i][0]
-                type = comps[i][1]
-                dom = BG.comp[type]['dom']
-                e_name = BG.dom[dom]['e'][0]+ '_' + name
-                if Nf[i,j] == '1':
-                    if len(eqin) == 0:
-                        eqin.append(f'{e_name}')
-                    else:
-                        eqin.append(f'+{e_name}')
-                else:
-                    if len(eqin) == 0:
-                        eqin.append(f'{Nf[i,j]}*{e_name}')
-                    else:
-                        eqin.append(f'+{Nf[i,j]}*{e_name}')
-        for i in range(len(Nr[:,0])):
-            if Nr[i,j] != '0':
-                name = comps[i][0]
-                type = comps[i][1]
-                dom = BG.comp[type]['dom']
-                e_name = BG.dom[dom]['e'][0]+ '_' + name
-                if Nr[i,j] == '1':
-                    if len(eqout) == 0:
-                        eqout.append(f'{e_name}')
-                    else:
-                        eqout.append(f'+{e_name}')
-                else:
-                    if len(eqout) == 0:
-                        eqout.append(f'{Nr[i,j]}*{e_name}')
-                    else:
-                        eqout.append(f'+{Nr[i,j]}*{e_name}')
-
-        component.appendMath(infix_to_mathml(''.join(eqin), ode_var_in))
-        component.appendMath(infix_to_mathml(''.join(eqout), ode_var_out))
-
-"""Read bond graph model from a csv file and create a CellML model from it."""
-def read_csvBG():
-    # Get the csv file from the user by opening a file dialog
-    message='Please select the forward matrix csv file:'
-    file_name_f = ask_for_file_or_folder(message)
-    directory = PurePath(file_name_f).parent
-    # by default, the reverse matrix csv file is the same as the forward matrix csv file expect that the file name ends with '_r'
-    file_name_r = file_name_f[:-6]+'_r.csv' 
+        eqin = [(1, _bond_term(cell, e_names[i])) for i, cell in zip(*Nf.col_nonzeros(j))]
+        eqout = [(1, _bond_term(cell, e_names[i])) for i, cell in zip(*Nr.col_nonzeros(j))]
+        appendMath(mml.equation(mml.signed_sum(eqin), ode_var_in))
+        appendMath(mml.equation(mml.signed_sum(eqout), ode_var_out))
+
+""" The MathML of the stoichiometric cell times the variable, e.g., '1' -> v_1, '2' -> 2*v_1, 'z_Na' -> z_Na*v_1"""
+def _bond_term(cell, var_name):
+    # the cells z/unit are the number or the symbol z with the units unit
+    if cell == '1':
+        return mml.ci(var_name)
+    z, unit = cell.split('/', 1) if '/' in cell else (cell, '')
+    try:
+        float(z)
+        coeff = mml.cn(z, unit if unit != '' else 'dimensionless')
+    except ValueError:
+        coeff = mml.ci(z)
+    return mml.times(coeff, mml.ci(var_name))
+
+""" Build the BG, steady state and test models of the stoichiometric csv files"""
+def build_csvBG(file_name_f, file_name_r, cse=SS_CSE, ss_options={}, name=None):
+    # input: cse, whether to eliminate the common subexpressions of the steady state equations (see cse_equations)
+    #        ss_options, the keyword arguments of derive_flux_ss, e.g., {'max_terms': 1000, 'timeout': 60}
+    #        name, the name of the network in the model names, the file name before the first '_' if None
+    # output: models, [model_BG, model_BG_param, model_ss, model_ss_param, model_BG_ss_param, model_BG_test, model_ss_test, model_BG_ss_test];
+    #         unitsSet, the names of the units of the steady state parameters, which may need to be added to the units model;
+    #         ss_mode, 'symbolic', or 'numeric' if v_ss is the number of the numeric mode of derive_flux_ss
     # Read the csv file, which has two rows of headers, the first row is the reaction type and the second row is the reaction name
-    CompName,CompType,ReName,ReType,N_f,N_r=load_matrix(file_name_f,file_name_r)
+    CompName,CompType,ReName,ReType,N_f_sparse,N_r_sparse=load_matrix_cached(file_name_f,file_name_r)
+    # The BG model is assembled from the sparse matrices, the steady state derivation works on the dense arrays of strings
+    N_f, N_r = N_f_sparse.todense(), N_r_sparse.todense()
     # Get the default model names: BG_filename, BG_filename_param, BG_filename_test = BG_filename + BG_filename_param, 
     # Steady state model names: ss_filename (ss expression), BG_ss_filename_param (link BG parameters to simplified parameters),  
     # ss_filename_param (simplified parameters), 
     # BG_ss_filename_test = (ss_filename + BG_ss_filename_param + BG_filename_param) , ss_filename_test = (ss_filename + ss_filename_param)
-    name_f=PurePath(file_name_f).stem.split('_')[0]
+    name_f=PurePath(file_name_f).stem.split('_')[0] if name is None else name
     model_BG = Model('BG_'+ name_f)
     model_BG_param = Model('BG_'+ name_f + '_param')
     model_BG_test = Model('BG_'+ name_f + '_test')
@@ -226,24 +234,27 @@ def read_csvBG():
     model_BG_ss_param = Model ('BG_ss_'+ name_f + '_param')
     # Default voi, units, and init
     voi = 't'
-    units = Units('second')
+    # The variables of model_BG (and model_BG_param) share the units of units_BG, the ones of the steady state models share units_ss
+    units_BG = UnitsRegistry()
+    units_ss = UnitsRegistry()
     voi = Variable(voi)
-    voi.setUnits(units)
+    voi.setUnits(units_BG.get('second'))
     # Build model_BG
     component=Component(model_BG.name())
     component_param=Component(model_BG_param.name())
     model_BG.addComponent(component)
     model_BG.addComponent(component_param)
     component.addVariable(voi)
-    component.setMath(MATH_HEADER)              
+    # The equations are collected and set at once, appending them one by one to the component copies the growing math each time
+    math = mml.MathAccumulator()
     for i, comp in enumerate(CompName):
-        add_BGcomp(model_BG, comp, CompType[i],voi.name())
+        add_BGcomp(model_BG, comp, CompType[i],voi.name(),math,units_BG)
     for i, re in enumerate(ReName):
-        add_BGcomp(model_BG, re, ReType[i],voi.name())
+        add_BGcomp(model_BG, re, ReType[i],voi.name(),math,units_BG)
     comps = list(zip(CompName,CompType))
     compd = list(zip(ReName,ReType))
-    add_BGbond(model_BG, comps, compd, N_f, N_r)
-    component.appendMath(MATH_FOOTER)
+    add_BGbond(model_BG, comps, compd, N_f_sparse, N_r_sparse, math)
+    math.commit(component)
     # Remove component_param from model_BG
     component_param_clone = model_BG.component(model_BG_param.name()).clone()
     model_BG.removeComponent(model_BG_param.name())
@@ -259,19 +270,23 @@ def read_csvBG():
         const_name = const
         var_const=Variable(const_name)
         unit_name = BG.const[const_name][1]
-        u=Units(unit_name)
-        var_const.setUnits(u)
+        var_const.setUnits(units_BG.get(unit_name))
         param_const = var_const.clone()
         param_const.setInitialValue(BG.const[const_name][0])
         model_BG.component(component.name()).addVariable(var_const)
         model_BG_param.component(component_param_clone.name()).addVariable(param_const)
 
-    vss_num,vss_den =  flux_ss_diagram(CompName,CompType,ReName,ReType,N_f,N_r)
-    v_ss_simplified, P, Q = simplify_flux_ss(vss_num,vss_den)
+    v_ss_simplified, P, Q = derive_flux_ss(CompName,CompType,ReName,ReType,N_f,N_r,**ss_options)
+    ss_mode = 'numeric' if v_ss_simplified.is_Number and len(P) == 0 else 'symbolic'
     # Build model_ss
     unitsSet = set()
     component_ss=Component(model_ss.name())
-    vss_equation =[(str(v_ss_simplified),'v_ss','')]
+    vss_equation =[(v_ss_simplified,'v_ss','')]
+    vss_cse_vars, P_cse_vars = [], []
+    if cse and ss_mode == 'symbolic':
+        P_units = {param: _units_expr(P[param][0], {}) for param in P}
+        vss_cse_vars, vss_equation = cse_equations([(v_ss_simplified,'v_ss')], P_units, 'cse_v_ss_')
+        P_cse_vars, P_equations_cse = cse_equations([(P[param][0],param.name) for param in P], {}, 'cse_P_')
     P_equations=[]
     v_ss = Variable('v_ss')
     v_ss.setUnits(BG.v_Ch_1)
@@ -279,116 +294,169 @@ def read_csvBG():
     for param in P:
         var_param=Variable(param.name)
         unit_name = P[param][1]
-        u=Units(unit_name)
         unitsSet.add(unit_name)
-        var_param.setUnits(u)
+        var_param.setUnits(units_ss.get(unit_name))
         component_ss.addVariable(var_param)
         ode_var= param.name
-        infix = str(P[param][0])
-        P_equations.append((infix,ode_var,''))
+        P_equations.append((P[param][0],ode_var,''))
     
     component_BG_ss = component_ss.clone() # P is the simplified parameters
+    if cse:
+        P_equations = P_equations_cse
+        _add_cse_variables(component_BG_ss, P_cse_vars, unitsSet, units_ss)
 
     for q in Q:
         var_q=Variable(q.name)
         unit_name = Q[q][1]
-        u=Units(unit_name)
         unitsSet.add(unit_name)
-        var_q.setUnits(u)
+        var_q.setUnits(units_ss.get(unit_name))
         component_ss.addVariable(var_q)  
+        # model_BG_ss_test takes the quantities from model_BG_ss_param, set as in model_ss_param
+        var_q_BG_ss = var_q.clone()
+        var_q_BG_ss.setInitialValue(1)
+        component_BG_ss.addVariable(var_q_BG_ss)
 
     
     component_ss_param=component_ss.clone() # P, Q are the simplified parameters
     component_ss.addVariable(v_ss) # v_ss is the simplified flux
+    _add_cse_variables(component_ss, vss_cse_vars, unitsSet, units_ss)
     
-    # Add the units to the units model
-    print('Adding units to the units model file...')
-    filename, existing_model = parseCellML()
-    relative_path=PurePath(filename).relative_to(directory).as_posix()
-    importSource = ImportSource()
-    importSource.setUrl(relative_path) 
-    imported_models=[existing_model]
-    importSources=[importSource]
-    import_types=['units']
-    units_defined = set()
-    for unit_numb in range(existing_model.unitsCount()):
-        units_defined.add(existing_model.units(unit_numb).name()) 
-    units_undefined = unitsSet - units_defined
-
-    for iunitsName in units_undefined:
-        inunits=_defineUnits(iunitsName)
-        existing_model.addUnits(inunits)        
-    writeCellML(filename, existing_model)
-
     for var_num in range(component_ss_param.variableCount()):
         component_ss_param.variable(var_num).setInitialValue(1)
 
     model_ss_param.addComponent(component_ss_param)
 
-    addEquations(component_ss, vss_equation)
+    if ss_mode == 'numeric':
+        # the number is the flux, in the units of v_ss
+        math = mml.MathAccumulator()
+        math.append(mml.equation(mml.cn(float(v_ss_simplified), v_ss.units().name()), 'v_ss'))
+        math.commit(component_ss)
+    else:
+        addEquations(component_ss, vss_equation)
     model_ss.addComponent(component_ss) # v_ss is the simplified flux, P is the simplified parameters
 
+    # The BG parameters are initialised in model_BG_param, which model_BG_ss_test imports and connects as well
     for var_num in range(component_param_clone.variableCount()):
-        component_BG_ss.addVariable(component_param_clone.variable(var_num).clone())
+        var_BG = component_param_clone.variable(var_num).clone()
+        var_BG.removeInitialValue()
+        component_BG_ss.addVariable(var_BG)
 
     component_BG_ss.removeVariable(v_ss)
     addEquations(component_BG_ss, P_equations)
 
     
     model_BG_ss_param.addComponent(component_BG_ss)
-   
-    print('model_BG, only import the units')
-    importCellML(model_BG,imported_models[0],importSources[0],import_types[0], imported_components_dict={})
-    editModel(directory,model_BG)
-    fullpath=writeCellML_UI(directory, model_BG)
-    writeCellML(fullpath, model_BG)
-    
-    print('model_BG_param, import the units')
-    importCellML(model_BG_param,imported_models[0],importSources[0],import_types[0], imported_components_dict={})
-    editModel(directory,model_BG_param)
-    fullpath=writeCellML_UI(directory, model_BG_param)
-    writeCellML(fullpath, model_BG_param)
-    
-    print('model_BG_ss, import the units')
-    importCellML(model_ss,imported_models[0],importSources[0],import_types[0], imported_components_dict={})
-    editModel(directory,model_ss)
-    fullpath=writeCellML_UI(directory, model_ss)
-    writeCellML(fullpath, model_ss)
-   
-    print('model_ss_param, import the units')
-    importCellML(model_ss_param,imported_models[0],importSources[0],import_types[0], imported_components_dict={})
-    editModel(directory,model_ss_param)
-    fullpath=writeCellML_UI(directory, model_ss_param)
-    writeCellML(fullpath, model_ss_param)
-    
-    print('model_BG_ss_param, import the units')
-    importCellML(model_BG_ss_param,imported_models[0],importSources[0],import_types[0], imported_components_dict={})
-    editModel(directory,model_BG_ss_param)
-    fullpath=writeCellML_UI(directory, model_BG_ss_param)
-    writeCellML(fullpath, model_BG_ss_param)
-   
-    print('model_BG_test, import the model_BG and model model_BG_param')
-    importCellML(model_BG_test,imported_models[0],importSources[0],import_types[0], imported_components_dict={})
-    editModel(directory,model_BG_test)
-    fullpath=writeCellML_UI(directory, model_BG_test)
-    writeCellML(fullpath, model_BG_test)
-    
-    print('model_ss_test, import the model_ss and model model_ss_param')
-    importCellML(model_ss_test,imported_models[0],importSources[0],import_types[0], imported_components_dict={})
-    editModel(directory,model_ss_test)
-    fullpath=writeCellML_UI(directory, model_ss_test)
-    writeCellML(fullpath, model_ss_test)
-   
-    print('model_BG_ss_test, import the model_BG_ss, model model_BG_ss_param and model_BG_param')
-    importCellML(model_BG_ss_test,imported_models[0],importSources[0],import_types[0], imported_components_dict={})
-    editModel(directory,model_BG_ss_test)
-    fullpath=writeCellML_UI(directory, model_BG_ss_test)
-    writeCellML(fullpath, model_BG_ss_test)
-    
+
+    models = [model_BG, model_BG_param, model_ss, model_ss_param, model_BG_ss_param, model_BG_test, model_ss_test, model_BG_ss_test]
+    return models, unitsSet, ss_mode
+
+def read_csvBG(cse=SS_CSE):
+    # input: cse, whether to eliminate the common subexpressions of the steady state equations (see cse_equations)
+    # Get the csv file from the user by opening a file dialog
+    message='Please select the forward matrix csv file:'
+    file_name_f = ask_for_file_or_folder(message)
+    directory = PurePath(file_name_f).parent
+    # by default, the reverse matrix csv file is the same as the forward matrix csv file expect that the file name ends with '_r'
+    file_name_r = file_name_f[:-6]+'_r.csv' 
+    models, unitsSet, ss_mode = build_csvBG(file_name_f, file_name_r, cse)
+    # Add the units to the units model
+    print('Adding units to the units model file...')
+    filename = ask_for_file_or_folder('Please select the CellML file:')
+    units_library = load_units_library(filename)
+    relative_path=PurePath(filename).relative_to(directory).as_posix()
+    importSource = ImportSource()
+    importSource.setUrl(relative_path) 
+    imported_models=[units_library.model]
+    importSources=[importSource]
+    import_types=['units']
+    units_undefined = unitsSet - units_library.names()
+    # the units model is only written if some units are added
+    units_library.add_units([_defineUnits(iunitsName) for iunitsName in sorted(units_undefined)], ask=True)
+
+    messages = ['model_BG, only import the units', 'model_BG_param, import the units', 'model_BG_ss, import the units',
+                'model_ss_param, import the units', 'model_BG_ss_param, import the units',
+                'model_BG_test, import the model_BG and model model_BG_param', 'model_ss_test, import the model_ss and model model_ss_param',
+                'model_BG_ss_test, import the model_BG_ss, model model_BG_ss_param and model_BG_param']
+    for model, message in zip(models, messages):
+        print(message)
+        importCellML(model,imported_models[0],importSources[0],import_types[0], imported_components_dict={})
+        editModel(directory,model)
+        fullpath=writeCellML_UI(directory, model)
+        writeCellML(fullpath, model)
+
+""" Derive the simplified steady state flux, or fall back to the numeric mode if the size or time budget is exceeded"""
+def derive_flux_ss(CompName,CompType,ReName,ReType,N_f,N_r, values={}, max_terms=SS_MAX_TERMS, timeout=SS_TIMEOUT, cache_dir=SS_CACHE_DIR, n_workers=SS_N_WORKERS, budget=SIMPLIFY_BUDGET):
+    # input: values, {name: value} of the parameters used in the numeric mode, see flux_ss_numeric; the numeric mode is only used
+    #                if values is given, since the flux at the default parameter values (1) is not a model of the network
+    #        max_terms, the maximum number of directional diagrams to derive symbolically
+    #        timeout, the maximum time in seconds of the symbolic derivation, None for no time limit
+    #        cache_dir, the directory of the steady state cache (ssCache), None to disable the cache
+    #        n_workers, the number of processes of flux_ss_diagram; the time limit only applies to the serial mode (n_workers=1),
+    #                   since the process pool cannot be started inside the time limited process
+    #        budget, the budgets of the stages of simplify_flux_ss
+    # output: v_ss_simplified, P, Q as simplify_flux_ss; in the numeric mode, v_ss_simplified is a number and P, Q are empty
+    # Raises RuntimeError if the budget is exceeded and values is not given
+    if cache_dir is not None:
+        # the form reached depends on the budget, a raised budget does not reuse the forms of the lower one
+        key = stoich_key(CompName,CompType,ReName,ReType,N_f,N_r,{'budget': budget})
+        cached = load_ss(key, cache_dir)
+        if cached is not None:
+            print('The steady state flux is loaded from the cache.')
+            return cached
+    n_terms = count_diagrams(CompName,CompType,N_f,N_r)
+    result = None
+    if n_terms > max_terms:
+        print(f'The steady state flux has {n_terms:.0f} terms, more than {max_terms}. Switching to the numeric mode.')
+    elif timeout is None or n_workers != 1:
+        result = flux_ss_symbolic(CompName,CompType,ReName,ReType,N_f,N_r,n_workers,budget)
+    else:
+        # Run in a separate process, so that it can be stopped when the time is up
+        with multiprocessing.Pool(1) as pool:
+            async_result = pool.apply_async(flux_ss_symbolic, (CompName,CompType,ReName,ReType,N_f,N_r,1,budget))
+            try:
+                result = async_result.get(timeout)
+            except multiprocessing.TimeoutError:
+                print(f'The symbolic steady state derivation takes more than {timeout} seconds. Switching to the numeric mode.')
+    if result is None:
+        if len(values) == 0:
+            raise RuntimeError('The symbolic steady state derivation exceeds its budget, raise max_terms or timeout, '
+                               'or give the parameter values (values) of the numeric mode')
+        # The numeric value depends on the parameter values, so it is not cached
+        v_ss, q_cd_ss = flux_ss_numeric(CompName,CompType,ReName,ReType,N_f,N_r,values)
+        return Float(v_ss), {}, {}
+    v_ss_simplified, P, Q, complete = result
+    # only the collected forms are cached, and only if no stage ran out of time, since the next run may get further
+    if cache_dir is not None and len(P)>0 and complete:
+        save_ss(key, v_ss_simplified, P, Q, cache_dir)
+    return v_ss_simplified, P, Q
+
+def flux_ss_symbolic(CompName,CompType,ReName,ReType,N_f,N_r,n_workers=1,budget=SIMPLIFY_BUDGET):
+    # output: v_ss_simplified, P, Q, complete, see _simplify_flux_ss
+    vss_num,vss_den =  flux_ss_diagram(CompName,CompType,ReName,ReType,N_f,N_r,n_workers)
+    return _simplify_flux_ss(vss_num,vss_den,budget)
+
+""" Count the directional diagrams, i.e., the number of terms of the steady state denominator before cancellation"""
+def count_diagrams(CompName,CompType,N_f,N_r):
+    # The Laplacian minors of the diagram with unit rate constants
+    Nf = np.array(N_f,dtype=float)
+    Nr = np.array(N_r,dtype=float)
+    chemodynamic_index = [i for i, x in enumerate(CompType) if x == 'Ce']
+    L = np.zeros((len(chemodynamic_index),len(chemodynamic_index)))
+    for j in range(Nf.shape[1]):
+        i_f = [k for k,i in enumerate(chemodynamic_index) if Nf[i,j]!=0]
+        i_r = [k for k,i in enumerate(chemodynamic_index) if Nr[i,j]!=0]
+        if len(i_f)==0 or len(i_r)==0 or i_f[-1]==i_r[-1]:
+            continue
+        L[[i_f[-1],i_r[-1]],[i_f[-1],i_r[-1]]] += 1
+        L[[i_r[-1],i_f[-1]],[i_f[-1],i_r[-1]]] -= 1
+    if len(L) < 2:
+        return len(L)
+    return sum(abs(np.linalg.det(np.delete(np.delete(L,i,0),i,1))) for i in range(len(L)))
 
 """ From the stoichiometric matrix to derive the steady state equations"""
-def flux_ss(CompName,CompType,ReName,ReType,N_f,N_r):
+def flux_ss(CompName,CompType,ReName,ReType,N_f,N_r,solver='LU'):
     # Note: cannot handle large matrix due to performance issue
+    # solver: 'LU', sympy LUsolve on rational functions; 'fraction_free', sparse fraction-free elimination over polynomials (sparseSolver)
     # define lambda functions to apply to the entries of matrix
     f_exp = lambda x: exp(x)
     f_log = lambda x: log(x)
@@ -428,24 +496,189 @@ def flux_ss(CompName,CompType,ReName,ReType,N_f,N_r):
     B_f=diag(*((N_source_f.T *(mu_source/(R*T))).applyfunc(f_exp)))
     B_r=diag(*((N_source_r.T *(mu_source/(R*T))).applyfunc(f_exp)))
     # Construct the matrix M and vector b for the linear equations
-    # b is a vector containing N number of 0s and the last entry is E; N is the number of reactions minus 1
-    b = Matrix([0 for i in range(Nf.shape[1]-1)]+[E])
+    # b is a vector containing N number of 0s and the last entry is E; N is the number of chemodynamic species minus 1
+    b = Matrix([0 for i in range(len(chemodynamic_index)-1)]+[E])
     M_ss=N_cd*(kappa*(B_f*N_cd_f.T-B_r*N_cd_r.T)*K_cd)
     M_G = Matrix([[1 for i in range(len(chemodynamic_index))]])
     M_ss_red = M_ss[0:len(chemodynamic_index)-1,:]
     M = nsimplify(M_ss_red.col_join(M_G))
+    M_v = nsimplify(kappa*(B_f*N_cd_f.T-B_r*N_cd_r.T)*K_cd)
+    if solver == 'fraction_free':
+        # The solution is kept as polynomial numerators over the common denominator det(M)
+        q_cd_num, q_cd_den = solve_fraction_free(M, b)
+        v_num = expand((M_v[0,:]*q_cd_num)[0])
+        vss_num, vss_den = fraction(cancel(v_num/q_cd_den))
+        return vss_num, vss_den
+    elif solver != 'LU':
+        sys.exit(f'Solver {solver} is not defined!')
     # Solve the linear equations
     q_cd_ss =  nsimplify(M.LUsolve(b))
-    M_v = nsimplify(kappa*(B_f*N_cd_f.T-B_r*N_cd_r.T)*K_cd)
     v = nsimplify(M_v*q_cd_ss)
     v_ss = factor(v[0]) # This is where the performance issue comes from
     # Get the numerator and denominator of the steady state equation
     vss_num, vss_den = fraction(v_ss)
     return vss_num, vss_den
-    # Simplify the steady state equation
-def simplify_flux_ss(vss_num,vss_den):
+
+""" Solve the steady state equations numerically, used when the symbolic derivation is too expensive"""
+def flux_ss_numeric(CompName,CompType,ReName,ReType,N_f,N_r,values={}):
+    # input: values, {name: value} of the parameters, i.e., kappa_{re}, K_{comp}, q_{comp} of the chemostats, E, V_m, and the constants F, R, T;
+    #        the constants default to BG.const and the other parameters default to 1, as in the generated parameter models
+    # output: v_ss, the steady state flux of the first reaction; q_cd_ss, the steady state quantities of the chemodynamic species
+    para = {const: BG.const[const][0] for const in BG.const}
+    para.update(values)
+    value = lambda name: float(para.get(name, 1))
+    Nf = np.array(N_f,dtype=float)
+    Nr = np.array(N_r,dtype=float)
+    chemostatic_index = [i for i, x in enumerate(CompType) if x == 'Se']
+    chemodynamic_index = [i for i, x in enumerate(CompType) if x == 'Ce']
+    electrogenic_index = [i for i, x in enumerate(CompType) if x == 'Ve']
+    kappa = np.array([value(f'kappa_{re}') for re in ReName])
+    K_cd = np.array([value(f'K_{CompName[i]}') for i in chemodynamic_index])
+    # The potentials of the sources divided by RT
+    mu_cs = np.array([np.log(value(f'K_{CompName[i]}')*value(f'q_{CompName[i]}')) for i in chemostatic_index])
+    mu_e = np.full(len(electrogenic_index), value('F')*value('V_m')/(value('R')*value('T')))
+    source_index = chemostatic_index + electrogenic_index
+    mu_source = np.append(mu_cs, mu_e)
+    B_f = np.exp(Nf[source_index,:].T @ mu_source)
+    B_r = np.exp(Nr[source_index,:].T @ mu_source)
+    N_cd_f = Nf[chemodynamic_index,:]
+    N_cd_r = Nr[chemodynamic_index,:]
+    N_cd = N_cd_r - N_cd_f
+    # Same linear equations as flux_ss, with the last balance replaced by the total quantity E
+    M_v = kappa[:,None]*(B_f[:,None]*N_cd_f.T - B_r[:,None]*N_cd_r.T)*K_cd[None,:]
+    M = np.vstack([(N_cd @ M_v)[:-1,:], np.ones(len(chemodynamic_index))])
+    b = np.zeros(len(chemodynamic_index))
+    b[-1] = value('E')
+    q_cd_ss = np.linalg.solve(M, b)
+    v_ss = float((M_v @ q_cd_ss)[0])
+    return v_ss, q_cd_ss
+
+""" Simplify the steady state equation in stages, each within its wall-clock and term-count budget"""
+def simplify_flux_ss(vss_num,vss_den,budget=SIMPLIFY_BUDGET):
+    # Stages (see SIMPLIFY_BUDGET): 
+    # 'collect', collect the coefficients of the q, E and exp(F*V_m/(R*T)) terms as the parameters P;
+    # 'group', pull the common factors out of the collected numerator and denominator (factor_terms);
+    #          the grouping is not CSE-based, since v_ss is a single expression here and the subexpressions of a cse would be
+    #          substituted back and flattened again by sympy. The CSE is done where the intermediate variables can be defined,
+    #          when the equations are added to the steady state models (cse_equations, see the cse option of build_csvBG);
+    # 'factor', fully factor the collected numerator.
+    # When a budget runs out, the best form reached so far is returned
+    # vss_num and vss_den are either sympy expressions (flux_ss) or sparse polynomials (flux_ss_diagram)
+    return _simplify_flux_ss(vss_num,vss_den,budget)[:3]
+
+def _simplify_flux_ss(vss_num,vss_den,budget=SIMPLIFY_BUDGET):
+    # output: v_ss_simplified, P, Q, complete; complete is False if a stage ran out of its time budget, 
+    #         the stages skipped for their term budgets depend only on the budget and the network
+    if isinstance(vss_num, PolyElement):
+        collected = _run_stage('collect', budget, _collect_flux_ss_ring, vss_num, vss_den, budget['collect']['terms'])
+    else:
+        collected = _run_stage('collect', budget, _collect_flux_ss, vss_num, vss_den, budget['collect']['terms'])
+    if collected is None:
+        print('The unsimplified steady state flux is returned.')
+        if isinstance(vss_num, PolyElement):
+            vss_num, vss_den = vss_num.as_expr(), vss_den.as_expr()
+        Q = {qi:(qi,'fmol') for qi in (vss_num.free_symbols | vss_den.free_symbols) if (qi.name.startswith('q') or qi==E)}
+        return vss_num/vss_den, {}, Q, False
+    c_vss_num_simp, c_vss_den_simp, P, Q = collected
+    n_terms = len(Add.make_args(c_vss_num_simp)) + len(Add.make_args(c_vss_den_simp))
+    best = 'collect'
+    complete = True
+    if n_terms <= budget['group']['terms']:
+        grouped = _run_stage('group', budget, lambda num, den: (factor_terms(num), factor_terms(den)), c_vss_num_simp, c_vss_den_simp)
+        if grouped is not None:
+            c_vss_num_simp, c_vss_den_simp = grouped
+            best = 'group'
+        else:
+            complete = False
+    else:
+        print(f'The group stage is skipped: {n_terms} terms, more than {budget["group"]["terms"]}.')
+    if best == 'group' and n_terms <= budget['factor']['terms']:
+        factored = _run_stage('factor', budget, factor, c_vss_num_simp)
+        if factored is not None:
+            c_vss_num_simp = factored
+            best = 'factor'
+        else:
+            complete = False
+    elif best == 'group':
+        print(f'The factor stage is skipped: {n_terms} terms, more than {budget["factor"]["terms"]}.')
+    print(f'The steady state flux is simplified up to the {best} stage.')
+    print('c_vss_num_sim=\n',c_vss_num_simp)
+    print('c_vss_den_sim=\n',c_vss_den_simp)
+    v_ss_simplified = c_vss_num_simp/c_vss_den_simp
+    print('v_ss_simplified=\n',v_ss_simplified)
+    for key in P.keys():
+        print(key,'=',P[key])
+    return v_ss_simplified, P, Q, complete
+
+class SimplifyBudgetExceeded(Exception):
+    pass
+
+""" Run one stage of simplify_flux_ss, return None if the stage runs out of its budget"""
+def _run_stage(stage, budget, func, *args):
+    # The wall-clock budget is enforced with SIGALRM where available (Unix, main thread); elsewhere the stage runs to completion
+    seconds = budget[stage]['time']
+    use_alarm = seconds is not None and hasattr(signal, 'SIGALRM') and threading.current_thread() is threading.main_thread()
+    if use_alarm:
+        def handler(signum, frame):
+            raise SimplifyBudgetExceeded(stage)
+        previous = signal.signal(signal.SIGALRM, handler)
+    try:
+        if use_alarm: # armed inside the try, so that a short budget cannot expire before the exception is handled
+            signal.setitimer(signal.ITIMER_REAL, seconds)
+        return func(*args)
+    except SimplifyBudgetExceeded:
+        print(f'The {stage} stage runs out of its {seconds} seconds budget.')
+        return None
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+
+""" Collect the coefficients of the sparse polynomial numerator and denominator as the parameters P"""
+def _collect_flux_ss_ring(vss_num,vss_den,max_terms=None):
+    # Collecting the coefficients of the q, E and exp(F*V_m/(R*T)) terms is grouping the exponent tuples by the exponents of these generators
+    if max_terms is not None and len(vss_num) + len(vss_den) > max_terms:
+        print(f'The collect stage is skipped: more than {max_terms} terms.')
+        return None
+    ring_ = vss_num.ring
+    q_index = [k for k,s in enumerate(ring_.symbols) if (s.is_Symbol and (s.name.startswith('q') or s==E)) or s.func==exp]
+    P={}
+    Q={}
+    collected = ([],[])
+    for n,poly in enumerate([vss_num, vss_den]):
+        groups = {}
+        for monom, coeff in poly.terms():
+            key = tuple(monom[k] for k in q_index)
+            rest = list(monom)
+            for k in q_index:
+                rest[k] = 0
+            groups.setdefault(key, {})[tuple(rest)] = coeff
+        for key in groups:
+            coeff = ring_.from_dict(groups[key])
+            sign = 1
+            if coeff.LC < 0:
+                coeff, sign = -coeff, -1
+            coeff = coeff.as_expr()
+            P_i = Symbol(f'P_{len(P)}')
+            P.update({P_i:(coeff,_get_Units(coeff))})
+            collected[n].append(sign*P_i*Mul(*[ring_.symbols[k]**e for k,e in zip(q_index,key)]))
+            for k,e in zip(q_index,key):
+                if e != 0 and ring_.symbols[k].is_Symbol:
+                    Q.update({ring_.symbols[k]:(ring_.symbols[k],'fmol')})
+    return Add(*collected[0]), Add(*collected[1]), P, Q
+
+""" Collect the coefficients of the numerator and denominator as the parameters P"""
+def _collect_flux_ss(vss_num,vss_den,max_terms=None):
+    # Expand as sparse polynomials (see _collect_flux_ss_ring), which is much cheaper than sympy expand, 
+    # so that the terms are counted before the expanded expressions are built
+    ring_, (poly_num, poly_den) = exprs_to_ring([vss_num, vss_den])
+    if max_terms is not None and len(poly_num) + len(poly_den) > max_terms:
+        print(f'The collect stage is skipped: more than {max_terms} terms.')
+        return None
     # Get the subexpression of vss_num containing q, E and exp(F*V_m/(R*T))
-    vss_num_terms = Add.make_args(expand(vss_num))
+    vss_num = poly_num.as_expr()
+    vss_den = poly_den.as_expr()
+    vss_num_terms = Add.make_args(vss_num)
     vss_num_subterms =[]
     Q={}
     for i in range(len(vss_num_terms)):
@@ -458,7 +691,7 @@ def simplify_flux_ss(vss_num,vss_den):
         elif len(qsubliterals)==1:
             vss_num_subterms.append(qsubliterals[0])
     # Get the subexpression of vss_den containing q and exp(F*V_m/(R*T))
-    vss_den_terms = Add.make_args(expand(vss_den))
+    vss_den_terms = Add.make_args(vss_den)
     vss_den_subterms =[]
     for i in range(len(vss_den_terms)):
         subliterals=[j for j in vss_den_terms[i].atoms() if str(j).startswith('q')]
@@ -468,89 +701,132 @@ def simplify_flux_ss(vss_num,vss_den):
         elif len(subliterals)==1:
             vss_den_subterms.append(subliterals[0])
     
-    def join_unit (expri):
-        symbols_expri = expri.atoms(Symbol)
-        unit_list =[]
-        first_unit=[]
-        for s in symbols_expri:
-           power_s = Poly(expri,s).monoms()
-           if power_s[0][0] == 1:
-               first_unit.append(f'{s.name}')
-           else:
-               unit_list.append(f'{s.name}{power_s[0][0]}')
-        unit_list = first_unit + unit_list
-        unit_expr = '_'.join(unit_list)
-
-        return unit_expr
-    # Get the units of the parameters P
-    def get_Units(terms):
-        first_term = Add.make_args(terms)[0]
-        Units_list=[]
-        Ks_units=[1/Symbol('fmol') for j in first_term.atoms() if str(j).startswith('K')]
-        kappas_units=[Symbol('fmol')/Symbol('sec') for j in first_term.atoms() if str(j).startswith('kappa')]
-        E_units = [Symbol('fmol') for j in first_term.atoms() if j==E]
-        if len(Ks_units)>0:
-            Units_list=Units_list+Ks_units
-        if len(kappas_units)>0:
-            Units_list=Units_list+kappas_units
-        if len(E_units)>0:
-            Units_list=Units_list+E_units
-
-        iUnits =  Mul(*Units_list) 
-        # if iUnits is number: return dimensionless
-        if iUnits.is_number: return 'dimensionless'
-        else: 
-            Units_num, Units_den=fraction(iUnits)
-        if Units_num .is_number: # join the items in Units_den with '_'
-            cellml_units_den = join_unit (Units_den) 
-            cellml_units = f'per_{cellml_units_den}'
-        else:
-            cellml_units_num = join_unit (Units_num)
-            cellml_units_den = join_unit (Units_den)
-            cellml_units = f'{cellml_units_num}_per_{cellml_units_den}'
-
-        return cellml_units    
-    
-    # Collect the terms of the numerator and denominator to simplify the expression
+    # Collect the terms of the numerator and denominator, and replace the coefficients with P
     P={}
-    dict_vss_num= collect(expand(vss_num),vss_num_subterms, evaluate=False)
-    dict_vss_num_keys = list(dict_vss_num.keys())
-    sub_dict = {}
-    for i,key in enumerate(dict_vss_num_keys):
+    dict_vss_num= collect(vss_num,vss_num_subterms, evaluate=False)
+    c_vss_num = []
+    for i,key in enumerate(dict_vss_num):
         if dict_vss_num[key].could_extract_minus_sign():
-            sub_dict.update({-dict_vss_num[key]:Symbol(f'P_{i}')})
-            P.update({Symbol(f'P_{i}'):(-dict_vss_num[key],get_Units(dict_vss_num[key]))})
+            P.update({Symbol(f'P_{i}'):(-dict_vss_num[key],_get_Units(dict_vss_num[key]))})
+            c_vss_num.append(-Symbol(f'P_{i}')*key)
         else:
-            sub_dict.update({dict_vss_num[key]:Symbol(f'P_{i}')})
-            P.update({Symbol(f'P_{i}'):(dict_vss_num[key],get_Units(dict_vss_num[key]))})
+            P.update({Symbol(f'P_{i}'):(dict_vss_num[key],_get_Units(dict_vss_num[key]))})
+            c_vss_num.append(Symbol(f'P_{i}')*key)
 
-    c_vss_num = collect(expand(vss_num),vss_num_subterms)
-    c_vss_num_simp= factor( (c_vss_num).subs(sub_dict))
-    print('c_vss_num_sim=\n',c_vss_num_simp)
-
-    dict_vss_den= collect(expand(vss_den),vss_den_subterms, evaluate=False)
-    dict_vss_den_keys = list(dict_vss_den.keys())
-    sub_dict = {}
-    for j,key in enumerate(dict_vss_den_keys):
+    dict_vss_den= collect(vss_den,vss_den_subterms, evaluate=False)
+    c_vss_den = []
+    for j,key in enumerate(dict_vss_den):
         if dict_vss_den[key].could_extract_minus_sign():
-            sub_dict.update({-dict_vss_den[key]:Symbol(f'P_{i+j+1}')})
-            P.update({Symbol(f'P_{i+j+1}'):(-dict_vss_den[key],get_Units(dict_vss_den[key]))})
+            P.update({Symbol(f'P_{i+j+1}'):(-dict_vss_den[key],_get_Units(dict_vss_den[key]))})
+            c_vss_den.append(-Symbol(f'P_{i+j+1}')*key)
         else:
-            sub_dict.update({dict_vss_den[key]:Symbol(f'P_{i+j+1}')})
-            P.update({Symbol(f'P_{i+j+1}'):(dict_vss_den[key],get_Units(dict_vss_den[key]))})
+            P.update({Symbol(f'P_{i+j+1}'):(dict_vss_den[key],_get_Units(dict_vss_den[key]))})
+            c_vss_den.append(Symbol(f'P_{i+j+1}')*key)
+    return Add(*c_vss_num), Add(*c_vss_den), P, Q
 
-    c_vss_den= collect(expand(vss_den),vss_den_subterms)
-    c_vss_den_simp= (c_vss_den).subs(sub_dict)
-    print('c_vss_den_sim=\n',c_vss_den_simp)
-    v_ss_simplified = c_vss_num_simp/c_vss_den_simp
-    print('v_ss_simplified=\n',v_ss_simplified)
-    for key in P.keys():
-        print(key,'=',P[key])
-    return v_ss_simplified, P, Q
-    
-def flux_ss_diagram(CompName,CompType,ReName,ReType,N_f,N_r):
+""" Join the symbols of the units product as the CellML units name"""
+def _join_unit (expri):
+    symbols_expri = expri.atoms(Symbol)
+    unit_list =[]
+    first_unit=[]
+    for s in symbols_expri:
+       power_s = Poly(expri,s).monoms()
+       if power_s[0][0] == 1:
+           first_unit.append(f'{s.name}')
+       else:
+           unit_list.append(f'{s.name}{power_s[0][0]}')
+    unit_list = first_unit + unit_list
+    unit_expr = '_'.join(unit_list)
+
+    return unit_expr
+
+""" Get the units of the parameters P"""
+def _get_Units(terms):
+    first_term = Add.make_args(terms)[0]
+    Units_list=[]
+    Ks_units=[1/Symbol('fmol') for j in first_term.atoms() if str(j).startswith('K')]
+    kappas_units=[Symbol('fmol')/Symbol('sec') for j in first_term.atoms() if str(j).startswith('kappa')]
+    E_units = [Symbol('fmol') for j in first_term.atoms() if j==E]
+    if len(Ks_units)>0:
+        Units_list=Units_list+Ks_units
+    if len(kappas_units)>0:
+        Units_list=Units_list+kappas_units
+    if len(E_units)>0:
+        Units_list=Units_list+E_units
+
+    iUnits =  Mul(*Units_list) 
+    return _units_name(iUnits)
+
+""" Get the CellML units name of the units product, e.g., fmol/sec -> fmol_per_sec"""
+def _units_name(iUnits):
+    # if iUnits is number: return dimensionless
+    if iUnits.is_number: return 'dimensionless'
+    else: 
+        Units_num, Units_den=fraction(iUnits)
+    if Units_num .is_number: # join the items in Units_den with '_'
+        cellml_units_den = _join_unit (Units_den) 
+        cellml_units = f'per_{cellml_units_den}'
+    elif Units_den.is_number:
+        cellml_units = _join_unit (Units_num)
+    else:
+        cellml_units_num = _join_unit (Units_num)
+        cellml_units_den = _join_unit (Units_den)
+        cellml_units = f'{cellml_units_num}_per_{cellml_units_den}'
+
+    return cellml_units
+
+""" Get the units product of an expression of the BG parameters, q, E and the simplified parameters P"""
+def _units_expr(expr, units_of):
+    # input: units_of, {Symbol: units product} of the symbols which are not BG parameters, q or E, e.g., P and the intermediate variables
+    # The terms of a sum are assumed to have the same units; functions such as exp are dimensionless
+    if expr.is_Symbol:
+        if expr in units_of: return units_of[expr]
+        if expr.name.startswith('K'): return 1/Symbol('fmol')
+        if expr.name.startswith('kappa'): return Symbol('fmol')/Symbol('sec')
+        if expr.name.startswith('q') or expr==E: return Symbol('fmol')
+        return Integer(1)
+    if expr.is_Number: return Integer(1)
+    if expr.is_Add: return _units_expr(expr.args[0], units_of)
+    if expr.is_Mul: return Mul(*[_units_expr(arg, units_of) for arg in expr.args])
+    if expr.is_Pow: return _units_expr(expr.base, units_of)**expr.exp
+    return Integer(1)
+
+""" Add the intermediate variables of cse_equations to the component"""
+def _add_cse_variables(component, cse_vars, unitsSet, units):
+    # input: units, the UnitsRegistry of the model
+    for name, unit_name in cse_vars:
+        var_cse=Variable(name)
+        var_cse.setUnits(units.get(unit_name))
+        unitsSet.add(unit_name)
+        component.addVariable(var_cse)
+
+""" Common subexpression elimination of the equations, the repeated subexpressions are defined as intermediate variables"""
+def cse_equations(equations, units_of={}, prefix='cse_'):
+    # input: equations, [(expr, var_name)]; units_of, {Symbol: units product} as _units_expr
+    # output: cse_vars, [(name, units_name)] of the intermediate variables;
+    #         cse_equations, [(expr, var_name, '')] of the intermediate variables followed by the reduced equations (see addEquations)
+    # exp(F*V_m/(R*T)) is kept as a whole, so that the intermediate variables are products and sums of the parameters and q
+    exp_term = exp(F*V_m/(R*T))
+    exp_dummy = Dummy('exp_term')
+    exprs = [sympify(eq[0]).xreplace({exp_term: exp_dummy}) for eq in equations]
+    replacements, reduced = cse(exprs, symbols=numbered_symbols(prefix))
+    units_of = dict(units_of)
+    cse_vars = []
+    cse_eqs = []
+    for x, sub_expr in replacements:
+        units_of[x] = _units_expr(sub_expr, units_of)
+        cse_vars.append((x.name, _units_name(units_of[x])))
+        cse_eqs.append((sub_expr.xreplace({exp_dummy: exp_term}), x.name, ''))
+    for eq, expr in zip(equations, reduced):
+        cse_eqs.append((expr.xreplace({exp_dummy: exp_term}), eq[1], ''))
+    return cse_vars, cse_eqs
+
+def flux_ss_diagram(CompName,CompType,ReName,ReType,N_f,N_r,n_workers=1):
     # Based on the approach proposed in 
     # Hill, Terrell. Free energy transduction in biology: the steady-state kinetic and thermodynamic formalism. Elsevier, 2012.
+    # The steady state weight of each chemodynamic species is the sum of its directional diagrams (King-Altman), 
+    # which is computed as a minor of the weighted Laplacian of the diagram (matrix-tree theorem), so multi-cycle diagrams are also covered.
+    # n_workers: the number of processes to compute the minors, 1 for the serial mode, None for all the cores
     
     # convert the string stoichiometric matrix to float matrix   
     Nf = nsimplify(Matrix(np.array(N_f,dtype=float)))
@@ -559,12 +835,9 @@ def flux_ss_diagram(CompName,CompType,ReName,ReType,N_f,N_r):
     q_cd = [f'q_{comp}' for i,comp in enumerate(CompName) if CompType[i]=='Ce']
     # Get the reaction rate constants kappa
     kappa = [Symbol(f'kappa_{re}') for re in ReName]
-    # Construct a directed graph of the reaction network
     # Compute the apparent reaction rate constants of the enzyme reaction network
-    G = nx.DiGraph()
-    for i,comp in enumerate(CompName):
-        if CompType[i]=='Ce':
-            G.add_node(comp)  
+    # Each reaction is an edge of the diagram: [q_f, q_r, k_f, k_r], parallel edges are kept
+    edge_list = []
     for j,re in enumerate(ReName):
         k_f_terms =[]
         k_r_terms =[]
@@ -597,43 +870,90 @@ def flux_ss_diagram(CompName,CompType,ReName,ReType,N_f,N_r):
         dict_kf= collect(kf_exp,q_f, evaluate=False)
         kr_exp = nsimplify(kappa[j]*exp(sum((k_r_mat)/(R*T))))
         dict_kr= collect(kr_exp,q_r, evaluate=False)
-        G.add_edge(q_f.name,q_r.name,reaction=re, k_f=dict_kf[list(dict_kf.keys())[0]], k_r=dict_kr[list(dict_kr.keys())[0]])
+        edge_list.append([q_f.name, q_r.name, dict_kf[list(dict_kf.keys())[0]], dict_kr[list(dict_kr.keys())[0]]])
     
-    edge_list = list(G.edges(data=True))
-    
-    # Construct a 2D sympy matrix to store the product of the rate constants on the edges
-    # the first dimension is the number of q_cd, the second dimension is the number of edges (reactions)
-    k_mat = Matrix([[0 for i in range(len(edge_list))] for j in range(len(q_cd))])
-    for  j, edgej in enumerate (edge_list):
-        G_copy = G.copy()
-        G_copy.remove_edge(edgej[0],edgej[1]) # Partial diagram
-        for i, q in enumerate (q_cd):
-            item = []
-            # Get the edge list that connects the node q in the reverse direction
-            edge_list_q = list(nx.edge_dfs(G_copy,q,orientation='ignore'))
-            edge_list_q_rev=[edge for edge in edge_list_q if edge[2]=='reverse']
-            for edge in edge_list_q_rev:
-                item.append(G_copy.get_edge_data(edge[0],edge[1])['k_f'])                          
-            # Get the edge list that connects the node q in the forward direction
-            edge_list_q_fwd = [edge for edge in edge_list_q if edge[2]=='forward']
-            for edge in edge_list_q_fwd:
-                item.append(G_copy.get_edge_data(edge[0],edge[1])['k_r'])
-            # Get the product of all the k_f/k_r on the path reaching q
-            k_mat[i,j] = prod(item)
-    # Add the columns of the k_mat to get the steady state expression of q
-    q_ss_E = Matrix([0 for i in range(len(q_cd))])
-    for i in range(len(q_cd)):
-        q_ss_E[i] = sum(k_mat[i,:])
-    
-    kf_all,kr_all = [],[]
-    for  j, edgej in enumerate (edge_list):
-        kf_all.append(G.get_edge_data(edgej[0],edgej[1])['k_f'])
-        kr_all.append(G.get_edge_data(edgej[0],edgej[1])['k_r'])
-
-    vss_num = factor(E*(prod(kf_all)-prod(kr_all)))
-    vss_den= sum(q_ss_E[:])
+    # Work on sparse polynomials over the kappa, K, q, E and exp(F*V_m/(R*T)) generators, 
+    # the expressions are only converted back to sympy expressions when the parameters P are collected
+    ring_, elements = exprs_to_ring([E] + [k for edge in edge_list for k in edge[2:]])
+    E_ring = elements[0]
+    for j, edge in enumerate(edge_list):
+        edge[2], edge[3] = elements[1+2*j], elements[2+2*j]
+    # Get the steady state expression of q (up to the common factor E/sum(q_ss_E)) from the Laplacian minors
+    L = diagram_laplacian(q_cd, edge_list)
+    if n_workers == 1:
+        q_ss_E = [laplacian_minor(ring_, L, i) for i in range(len(q_cd))]
+    else:
+        q_ss_E = parallel_laplacian_minors(ring_, L, n_workers)
+    # The steady state flux is the net flux of the first reaction; 
+    # for a single cycle diagram this reduces to E*(prod(kf_all)-prod(kr_all))
+    i_f = q_cd.index(edge_list[0][0])
+    i_r = q_cd.index(edge_list[0][1])
+    vss_num = E_ring*(edge_list[0][2]*q_ss_E[i_f] - edge_list[0][3]*q_ss_E[i_r])
+    vss_den = sum(q_ss_E, ring_.zero)
     return vss_num,vss_den
-                    
+
+""" Construct the weighted Laplacian of the King-Altman diagram"""
+def diagram_laplacian(q_cd, edge_list):
+    # input: q_cd, the names of the nodes (quantities of the chemodynamic species)
+    #        edge_list, [[q_f, q_r, k_f, k_r]], k_f is the rate constant (PolyElement) from q_f to q_r, k_r is the rate constant from q_r to q_f
+    # output: L, the sparse rows [{j: L[i,j]}], L[i,i] is the sum of the rate constants leaving node i, L[i,j] is minus the rate constant from node j to node i
+    node_index = {q:i for i,q in enumerate(q_cd)}
+    L = [{} for q in q_cd]
+    def add(i, j, k):
+        L[i][j] = L[i].get(j, 0) + k
+        if not L[i][j]:
+            del L[i][j]
+    for edge in edge_list:
+        i_f = node_index[edge[0]]
+        i_r = node_index[edge[1]]
+        if i_f == i_r:
+            continue # a self loop does not change the steady state
+        add(i_f, i_f, edge[2])
+        add(i_r, i_f, -edge[2])
+        add(i_r, i_r, edge[3])
+        add(i_f, i_r, -edge[3])
+    return L
+
+""" Get the sum of the directional diagrams of node i, i.e., the sum over the spanning trees directed to node i """
+def laplacian_minor(ring_, L, i):
+    # Fraction-free determinant of the sparse rows without row and column i
+    rows = [{j:a for j,a in row.items() if j != i} for r,row in enumerate(L) if r != i]
+    return det_fraction_free(ring_, rows)
+
+""" Compute all the Laplacian minors with a process pool"""
+def parallel_laplacian_minors(ring_, L, n_workers=None):
+    # Each minor is split into the cofactor expansion along its first row (one task per partial diagram), 
+    # and the terms are summed in the task order so that the result does not depend on the scheduling
+    tasks = []
+    for i in range(len(L)):
+        rows = [{j:a for j,a in row.items() if j != i} for r,row in enumerate(L) if r != i]
+        if len(rows) == 0:
+            tasks.append((i, None, ring_.symbols, ring_.domain, []))
+            continue
+        cols = sorted(set(j for row in rows for j in row))
+        for k in sorted(rows[0]):
+            # the minor of the entry (0,k), packed as plain dictionaries for the worker process
+            sub_rows = [{j:a for j,a in row.items() if j != k} for row in rows[1:]]
+            sub_rows.insert(0, {k: rows[0][k]})
+            tasks.append((i, cols.index(k)) + pack_rows(ring_, sub_rows))
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        terms = list(executor.map(_cofactor_term, tasks, chunksize=max(1, len(tasks)//(4*n_workers))))
+    weights = [ring_.zero]*len(L)
+    for task, term in zip(tasks, terms):
+        weights[task[0]] += ring_.from_dict(term)
+    return weights
+
+def _cofactor_term(task):
+    # the k-th term of the cofactor expansion along the first row; the first row only keeps the entry (0,k)
+    i, k, symbols, domain, rows = task
+    ring_, rows = unpack_rows(symbols, domain, rows)
+    if k is None:
+        return dict(ring_.one)
+    a_0k = list(rows[0].values())[0]
+    return dict((-1)**k*a_0k*det_fraction_free(ring_, rows[1:]))
+
 # main function
 if __name__ == "__main__":
     # Get the csv file from the user by opening a file dialog
@@ -0,0 +1,344 @@
+# Non-interactive conversion of many stoichiometric csv pairs into the eight CellML models of read_csvBG (BG2CellML.py)
+# e.g., python batchBG.py networks/ units_BG.cellml --config batch.json --report report.json
+# The networks are converted in parallel, and so are the eight models of each network; the units missing from the units model
+# are defined from the config file or from their names and written to the units model once, after all the networks are converted.
+# The written test models are then analysed, since the analyser needs the units they import.
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from libcellml import Analyser, Annotator, Importer, ImportSource, Issue, Units, Variable
+import cellml
+from build_CellMLV2 import importCellML, writeCellML, defineUnits, parseUnitsName, _checkUndefinedUnits
+from BG2CellML import build_csvBG, SS_CSE
+from unitsCache import load_units_library
+
+# The defaults of the config file (json)
+DEFAULT_CONFIG = {'output_dir': None, # None to write the models next to the csv files
+                  'n_workers': None, # None for all the cores
+                  'model_workers': None, # the processes writing the eight models of a network, None to share the cores among the networks
+                  'cse': SS_CSE, # see build_csvBG
+                  'ss_options': {}, # the keyword arguments of derive_flux_ss, e.g., {"max_terms": 1000, "timeout": 60}
+                  'units': {}, # {name: [[unitName, prefix, exponent, multiplier]]} of the units not in the units model, see defineUnits;
+                               # only needed for the names which parseUnitsName cannot define, e.g., fmol_per_sec is defined from its name
+                  'log': True} # write the output of each network to {model name}.log in the output directory
+# The test models import the components of the other models: model index -> indexes of the imported models (see build_csvBG)
+TEST_IMPORTS = {5: [0, 1], 6: [2, 3], 7: [2, 4, 1]}
+
+""" Load the config file, the missing keys take the default values"""
+def load_config(config_file=None):
+    config = dict(DEFAULT_CONFIG)
+    if config_file is not None:
+        with open(config_file, 'r') as f:
+            config.update(json.load(f))
+    return config
+
+""" Find the pairs of the forward and reverse csv files in a directory or a manifest"""
+def find_networks(source):
+    # input: source, a directory of *_f.csv and *_r.csv files, or a manifest file listing the forward csv files, one per line,
+    #        optionally followed by a comma and the reverse csv file; the paths are relative to the manifest
+    # output: [(file_name_f, file_name_r)]
+    source = Path(source)
+    if source.is_dir():
+        pairs = [(str(f), str(f)[:-6] + '_r.csv') for f in sorted(source.glob('*_f.csv'))]
+    else:
+        pairs = []
+        for line in source.read_text().splitlines():
+            line = line.strip()
+            if line == '' or line.startswith('#'):
+                continue
+            files = [str(source.parent / name.strip()) for name in line.split(',')]
+            pairs.append((files[0], files[1] if len(files) > 1 else files[0][:-6] + '_r.csv'))
+    return pairs
+
+""" The name of the network of the forward csv file, e.g., net_a for net_a_f.csv, which the model names are made of"""
+def network_name(file_name_f):
+    return Path(file_name_f).stem[:-2]
+
+def _output_dir(file_name_f, config):
+    return config['output_dir'] or str(Path(file_name_f).parent)
+
+def _new_report(file_name_f, file_name_r):
+    return {'network': network_name(file_name_f), 'file_f': file_name_f, 'file_r': file_name_r, 'status': 'ok', 'error': None, 'ss_mode': None,
+            'timings': {}, 'issues': {}, 'analyser_errors': {}, 'new_units': [], 'missing_units': []}
+
+def _connect_by_name(comp1, comp2):
+    # Map the variables with the same name in the two components
+    # output: the names of the mapped variables
+    names2 = set(comp2.variable(var_numb).name() for var_numb in range(comp2.variableCount()))
+    names = [comp1.variable(var_numb).name() for var_numb in range(comp1.variableCount()) if comp1.variable(var_numb).name() in names2]
+    for name in names:
+        Variable.addEquivalence(comp1.variable(name), comp2.variable(name))
+    return names
+
+""" Import the components of the BG and steady state models into the test models and connect them by the variable names"""
+def _build_test_models(models):
+    for test_index, imported in TEST_IMPORTS.items():
+        model = models[test_index]
+        sources = {}
+        for model_index in imported:
+            imported_model = models[model_index]
+            sources[imported_model.name()] = imported_model.component(0)
+            importSource = ImportSource()
+            importSource.setUrl(imported_model.name() + '.cellml')
+            importSource.setModel(imported_model)
+            # the components are renamed as their models, since e.g. the component of model_ss_param has the name of model_ss
+            importCellML(model, imported_model, importSource, 'component', {imported_model.name(): imported_model.component(0).name()})
+        for i in range(model.componentCount()):
+            for j in range(i+1, model.componentCount()):
+                comp1, comp2 = model.component(i), model.component(j)
+                # the mapped variables must be public in the imported components as well
+                for name in _connect_by_name(comp1, comp2):
+                    for comp in [comp1, comp2]:
+                        if sources[comp.name()].variable(name).interfaceType() == '':
+                            sources[comp.name()].variable(name).setInterfaceType(Variable.InterfaceType.PUBLIC)
+
+# The models of write_models, which the forked workers inherit instead of receiving them pickled
+_OUTPUT = {}
+
+def _import_units(model, units_model, units_defined, url, units_config):
+    # output: {'name', 'new_units', 'missing_units'}
+    # Each model has its own import source, since the ids assigned to a shared one would show up in the other models
+    result = {'name': model.name(), 'new_units': [], 'missing_units': []}
+    importSource = ImportSource()
+    importSource.setUrl(url)
+    importCellML(model, units_model, importSource, 'units', imported_components_dict={})
+    # The units not in the units model are imported as well if the config or their names define them
+    for unit in sorted(_checkUndefinedUnits(model)):
+        if unit in units_config or parseUnitsName(unit) is not None:
+            u = Units(unit)
+            u.setImportSource(importSource)
+            u.setImportReference(unit)
+            model.addUnits(u)
+            if unit not in units_defined:
+                result['new_units'].append(unit)
+        else:
+            result['missing_units'].append(unit)
+    model.fixVariableInterfaces()
+    if model.hasUnlinkedUnits():
+        model.linkUnits()
+    return result
+
+def _analyse_model(model, base_dir):
+    # Flatten the model with its imports and analyse it
+    # output: the descriptions of the errors of the importer and the analyser
+    importer = Importer()
+    importer.resolveImports(model, base_dir)
+    errors = [importer.issue(i).description() for i in range(importer.issueCount()) if importer.issue(i).level() == Issue.Level.ERROR]
+    if errors:
+        return errors
+    flat = importer.flattenModel(model)
+    # the imported models have their own ids, which may clash once they are in one model
+    annotator = Annotator()
+    annotator.setModel(flat)
+    annotator.clearAllIds()
+    analyser = Analyser()
+    analyser.analyseModel(flat)
+    return [analyser.issue(i).description() for i in range(analyser.issueCount()) if analyser.issue(i).level() == Issue.Level.ERROR]
+
+def _write_model(index):
+    # Validate, assign the ids and write the model of index in write_models
+    # output: (the number of validation issues, seconds, the printed output)
+    models, output_dir = _OUTPUT['args']
+    model = models[index]
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        start = time.perf_counter()
+        # the issues are printed to the log
+        issues = cellml.validate_model(model)
+        writeCellML(os.path.join(output_dir, model.name() + '.cellml'), model, False)
+    return issues, time.perf_counter() - start, log.getvalue()
+
+""" Import the units into the models, then validate, assign the ids and write the models in parallel"""
+def write_models(models, units_file, output_dir, units_config={}, n_workers=1):
+    # input: units_config, the units definitions of the config file; n_workers, the number of processes
+    # output: [{'name', 'seconds', 'issues', 'new_units', 'missing_units'}], in the order of the models;
+    #         issues, the number of validation issues
+    # The units are imported into all the models first, since the test models see the models they import.
+    # The rest only reads the model it writes, so the files are the same whatever the number of workers.
+    # The workers are forked, where fork is not available the models are written one by one
+    units_library = load_units_library(units_file)
+    units_model, units_defined = units_library.model, units_library.names()
+    url = Path(os.path.relpath(units_file, output_dir)).as_posix()
+    results = []
+    for model in models:
+        start = time.perf_counter()
+        results.append(_import_units(model, units_model, units_defined, url, units_config))
+        results[-1]['seconds'] = time.perf_counter() - start
+    _OUTPUT['args'] = (models, output_dir)
+    try:
+        if n_workers == 1 or 'fork' not in multiprocessing.get_all_start_methods():
+            written = [_write_model(index) for index in range(len(models))]
+        else:
+            with ProcessPoolExecutor(max_workers=min(n_workers, len(models)), mp_context=multiprocessing.get_context('fork')) as executor:
+                written = list(executor.map(_write_model, range(len(models))))
+    finally:
+        _OUTPUT.clear()
+    for result, (issues, seconds, log) in zip(results, written):
+        result['issues'] = issues
+        result['seconds'] += seconds
+        print(log, end='')
+    return results
+
+""" Convert one network into the eight CellML models"""
+def convert_network(file_name_f, file_name_r, units_file, config):
+    # output: report, {'network', 'status' ('ok', 'numeric' or 'failed'), 'error', 'ss_mode' (see build_csvBG), 'timings' {stage or model: seconds},
+    #                  'issues' {model: validation issues}, 'analyser_errors' {test model: [errors]}, 'new_units', 'missing_units'};
+    #         the network fails if any model has validation issues or some units are missing; the status is 'numeric' if the steady
+    #         state flux is the number of the numeric mode of derive_flux_ss, at the parameter values of ss_options, rather than an expression;
+    #         analyser_errors is filled by check_network, once the new units are in the units model
+    name = network_name(file_name_f)
+    output_dir = _output_dir(file_name_f, config)
+    report = _new_report(file_name_f, file_name_r)
+    os.makedirs(output_dir, exist_ok=True)
+    log = open(os.path.join(output_dir, name + '.log'), 'w') if config['log'] else open(os.devnull, 'w')
+    try:
+        with log, contextlib.redirect_stdout(log):
+            start = time.perf_counter()
+            models, unitsSet, report['ss_mode'] = build_csvBG(file_name_f, file_name_r, config['cse'], config['ss_options'], name)
+            _build_test_models(models)
+            report['timings']['build'] = time.perf_counter() - start
+            results = write_models(models, units_file, output_dir, config['units'], config['model_workers'])
+            for result in results:
+                report['timings'][result['name']] = result['seconds']
+                report['issues'][result['name']] = result['issues']
+                for key in ['new_units', 'missing_units']:
+                    report[key] += [unit for unit in result[key] if unit not in report[key]]
+        invalid = [model for model, issues in report['issues'].items() if issues > 0]
+        if report['missing_units']:
+            report['status'] = 'failed'
+            report['error'] = f"The units {report['missing_units']} are not defined in the units model or the config file"
+        elif invalid:
+            report['status'] = 'failed'
+            report['error'] = f"The models {invalid} have validation issues, see the log"
+        elif report['ss_mode'] == 'numeric':
+            report['status'] = 'numeric'
+            report['error'] = 'The steady state flux is a number at the parameter values of ss_options, the symbolic derivation exceeds its budget'
+    except (Exception, SystemExit) as e:
+        report['status'] = 'failed'
+        report['error'] = ''.join(traceback.format_exception_only(type(e), e)).strip()
+    return report
+
+def _convert_network(args):
+    return convert_network(*args)
+
+""" Analyse the written test models of a network converted by convert_network"""
+def check_network(report, config):
+    # output: report, with the analyser errors of the test models; the network fails if any test model has analyser errors
+    # the other models are parts of the test models, which are the only ones that can be analysed
+    names = list(report['issues'])
+    output_dir = _output_dir(report['file_f'], config)
+    log = open(os.path.join(output_dir, report['network'] + '.log'), 'a') if config['log'] else open(os.devnull, 'w')
+    try:
+        with log, contextlib.redirect_stdout(log):
+            for index in TEST_IMPORTS:
+                start = time.perf_counter()
+                model = cellml.parse_model(os.path.join(output_dir, names[index] + '.cellml'), True)
+                errors = _analyse_model(model, os.path.join(output_dir, ''))
+                report['timings'][names[index]] += time.perf_counter() - start
+                if errors:
+                    report['analyser_errors'][names[index]] = errors
+        if report['analyser_errors']:
+            report['status'] = 'failed'
+            report['error'] = f"The models {list(report['analyser_errors'])} are not valid for the analyser"
+    except Exception as e:
+        report['status'] = 'failed'
+        report['error'] = ''.join(traceback.format_exception_only(type(e), e)).strip()
+    return report
+
+def _check_network(args):
+    return check_network(*args)
+
+""" Add the units defined in the config file to the units model"""
+def update_units_model(units_file, new_units, config):
+    if len(new_units) == 0:
+        return
+    # the units library is written only if the units are still missing, e.g., not added by a concurrent batch job
+    load_units_library(units_file).add_units([defineUnits(unit, config['units'][unit] if unit in config['units'] else parseUnitsName(unit))
+                                              for unit in sorted(set(new_units))])
+
+""" Convert all the networks in parallel"""
+def batch_convert(source, units_file, config):
+    # output: [report] of convert_network, in the order of find_networks
+    networks = find_networks(source)
+    n_workers = config['n_workers'] or multiprocessing.cpu_count()
+    if config['model_workers'] is None:
+        config = dict(config, model_workers=max(1, multiprocessing.cpu_count() // max(1, min(n_workers, len(networks)))))
+    # The networks with the same name in the same output directory would overwrite each other's models, none of them is converted
+    outputs = {}
+    for file_name_f, file_name_r in networks:
+        key = (os.path.abspath(_output_dir(file_name_f, config)), network_name(file_name_f))
+        outputs.setdefault(key, []).append(file_name_f)
+    duplicates = {file_name_f: files for files in outputs.values() if len(files) > 1 for file_name_f in files}
+    tasks = [(file_name_f, file_name_r, units_file, config) for file_name_f, file_name_r in networks if file_name_f not in duplicates]
+    # Parse the units library once, the forked workers inherit it
+    load_units_library(units_file)
+    if n_workers == 1:
+        converted = [_convert_network(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            converted = list(executor.map(_convert_network, tasks))
+    converted = iter(converted)
+    reports = []
+    for file_name_f, file_name_r in networks:
+        if file_name_f in duplicates:
+            report = _new_report(file_name_f, file_name_r)
+            report['status'] = 'failed'
+            report['error'] = f"The networks {duplicates[file_name_f]} have the same name {report['network']} in the same output directory"
+            reports.append(report)
+        else:
+            reports.append(next(converted))
+    update_units_model(units_file, [unit for report in reports for unit in report['new_units']], config)
+    # The test models are analysed once the units they import are in the units model
+    checks = [index for index, report in enumerate(reports) if report['status'] != 'failed']
+    tasks = [(reports[index], config) for index in checks]
+    if n_workers == 1:
+        checked = [_check_network(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            checked = list(executor.map(_check_network, tasks))
+    for index, report in zip(checks, checked):
+        reports[index] = report
+    return reports
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert stoichiometric csv pairs into CellML models without user interaction.')
+    parser.add_argument('source', help='a directory of *_f.csv and *_r.csv files, or a manifest listing the *_f.csv files')
+    parser.add_argument('units', help='the CellML units model imported by the generated models')
+    parser.add_argument('--config', default=None, help='the json file of the defaults, see DEFAULT_CONFIG')
+    parser.add_argument('--output-dir', default=None, help='overrides output_dir of the config file')
+    parser.add_argument('--n-workers', type=int, default=None, help='overrides n_workers of the config file')
+    parser.add_argument('--model-workers', type=int, default=None, help='overrides model_workers of the config file')
+    parser.add_argument('--report', default=None, help='the json file of the per-model timings and failures, stdout by default')
+    args = parser.parse_args(argv)
+    config = load_config(args.config)
+    if args.output_dir is not None:
+        config['output_dir'] = args.output_dir
+    if args.n_workers is not None:
+        config['n_workers'] = args.n_workers
+    if args.model_workers is not None:
+        config['model_workers'] = args.model_workers
+    start = time.perf_counter()
+    reports = batch_convert(args.source, args.units, config)
+    summary = {'total_seconds': time.perf_counter() - start, 'n_networks': len(reports),
+               'n_failed': sum(report['status'] == 'failed' for report in reports),
+               'n_numeric': sum(report['status'] == 'numeric' for report in reports), 'networks': reports}
+    for report in reports:
+        print(f"{report['network']}: {report['status']} {sum(report['timings'].values()):.2f}s" +
+              (f" {report['error']}" if report['error'] else ''), file=sys.stderr)
+    if args.report is None:
+        json.dump(summary, sys.stdout, indent=1)
+    else:
+        with open(args.report, 'w') as f:
+            json.dump(summary, f, indent=1)
+    return 1 if summary['n_failed'] > 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
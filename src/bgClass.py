@@ -2,8 +2,9 @@
 import sys
 import numpy as np 
 import math
+import warnings
 from operator import attrgetter 
-from sympy import Matrix, S, nsimplify 
+from intNullspace import cycles, nullspace_matrix
 
 class CellMLft:
    # Format the CellML Text
@@ -330,9 +331,23 @@ class BG_module(object):
          cid.writelines(lines)
       cid.close()
       
+""" Ask the user for the type of each component whose type differs between the modules"""
+def ask_type(conflicts):
+   # input: conflicts, {component name: [types in the module order]}; output: {component name: type}
+   resolved = {}
+   for comp, types in conflicts.items():
+      print(f'The type of {comp} is inconsistent:{types}')
+      resolved[comp] = input(f"Please specify the type of {comp}:\n")
+   return resolved
+
+""" Keep the type of the first module for each component whose type differs between the modules"""
+def first_type(conflicts):
+   return {comp: types[0] for comp, types in conflicts.items()}
+
 class BG_model(object):
-   def __init__(self, name, modules):
+   def __init__(self, name, modules, type_policy=ask_type):
       # attribute: name, comps, imp, para, input, eq, imp, sys, varMap, eindx
+      # type_policy: resolve the types of the components shared by the modules with different types, see ask_type and first_type
       self.name = name
       self.comps = []
       self.input = []
@@ -344,10 +359,7 @@ class BG_model(object):
       self.eq = []
       self.eindx=[] # remove the electric component when converting kinetic parameters to BG parameters
       paraset = set()
-      emap = {} # direction of q to/from the module
-      compName =[] # all storage component names
-      compType =[] # all storage component types
-      tempcomps=[] # all storage components
+      occurrences = {} # {component name: [(storage component, module name, module direction)]} in the module order
       for m in modules:
          self.sys[m.name]['N_f'] = m.Nf
          self.sys[m.name]['N_r'] = m.Nr
@@ -364,13 +376,7 @@ class BG_model(object):
             self.input.append([e.input[0][0]+'_' + m.name , e.input[0][1], CellMLft.IO['priv-in']]) # flow contribution from the modules
             self.varMap[m.name].append([e.input[0][0], e.input[0][0]+'_' + m.name])
             self.varMap[m.name].append([e.output[0][0], e.output[0][0]]) # potential to the modules
-            tempcomps.append(e)
-            compName.append(e.name)
-            compType.append(e.type)
-            if e.name in emap:
-               emap[e.name].append([m.name,m.direc])
-            else:
-               emap[e.name]=[[m.name,m.direc]] 
+            occurrences.setdefault(e.name, []).append((e, m.name, m.direc))
          for p in m.para:
             paraset.add((p[0], p[1], CellMLft.IO['pub-in']))
            # self.varMap[m.name].append([p[0], p[0]])
@@ -378,70 +384,41 @@ class BG_model(object):
          self.para.append(list(para)) 
           # self.varMap[f'{name}_para'].append([list(para)[0], list(para)[0]])            
       # Identify common components (including electrical components)
-      arraycompName = np.array(compName)
-      arraycompType = np.array(compType)
-      compUnique=list(sorted(set(compName),key=compName.index))
+      compUnique = list(occurrences) # in the order of the first occurrence
+      conflicts = {}
+      for comp, occurs in occurrences.items():
+         types = [e.type for e, modulename, moduledirec in occurs]
+         if len(set(types))>1: 
+            conflicts[comp] = types
+      resolved = type_policy(conflicts) if conflicts else {}
       self.Kunique = [] # remove electrical components, i.e., only keep chemical components
       typeKeep =[]
-      for comp in compUnique:         
-         compIdx = np.array([i for i, x in enumerate(arraycompName) if x == comp])
-         types = arraycompType[compIdx]         
-         eq = BG_comp.dom[tempcomps[compIdx[0]].dom]['f'][0]+ '_' + comp + ' = '
-         if len(compIdx)==1:
-           modulename = emap[comp][0][0]
-           moduledirec = emap[comp][0][1]
-           indx = compIdx[0] 
-           typeKeep.append(arraycompType[indx])                             
-           if types in ['Ce','Se']:
-              self.Kunique.append(comp)
-           else:
-              self.eindx = compUnique.index(comp)
-
-           if moduledirec == 'in':
-              eq= eq + '-' + BG_comp.dom[tempcomps[indx].dom]['f'][0]+ '_' + comp + '_' + modulename
-           else:
-              eq= eq + '+' + BG_comp.dom[tempcomps[indx].dom]['f'][0]+ '_' + comp + '_' + modulename
-         else: # if duplicate          
-            if len(set(types))>1: # if the component types are different, ask user to decide
-              print(f'The type of {comp} is inconsistent:{types}')
-              ctype = input(f"Please specify the type of {comp}:\n")
-              typeKeep.append(ctype)
-            else:
-              typeKeep.append(compType[compIdx[0]]) # only keep the first one
-              ctype = compType[compIdx[0]]
-            if ctype in ['Ce','Se']:
-              self.Kunique.append(comp)
+      for k, comp in enumerate(compUnique):
+         occurs = occurrences[comp]
+         ctype = resolved.get(comp, occurs[0][0].type) # only keep the first one if the types are consistent
+         typeKeep.append(ctype)
+         if ctype in ['Ce','Se']:
+            self.Kunique.append(comp)
+         else:
+            self.eindx = k
+         eq = BG_comp.dom[occurs[0][0].dom]['f'][0]+ '_' + comp + ' = '
+         for e, modulename, moduledirec in occurs:
+            if moduledirec == 'in':
+               eq= eq +'-' + BG_comp.dom[e.dom]['f'][0]+ '_' + comp + '_' + modulename
             else:
-              self.eindx = compUnique.index(comp)           
-            for i,indx in enumerate(compIdx): 
-               modulename = emap[comp][i][0]
-               moduledirec = emap[comp][i][1]             
-               if moduledirec == 'in':
-                 eq= eq +'-' + BG_comp.dom[tempcomps[indx].dom]['f'][0]+ '_' + comp + '_' + modulename
-               else:
-                 eq= eq +'+' + BG_comp.dom[tempcomps[indx].dom]['f'][0]+ '_' + comp + '_' + modulename            
+               eq= eq +'+' + BG_comp.dom[e.dom]['f'][0]+ '_' + comp + '_' + modulename
          self.eq.append(eq+';\n')                     
       for i, e in enumerate(compUnique):
          compi= BG_comp(e, typeKeep[i])
          self.comps.append(compi)
          self.varMap[f'{name}_para'].append([compi.para[0][0], compi.para[0][0]])
          self.varMap[f'{name}_para'].append([compi.para[1][0], compi.para[1][0]])
-      # relations between submodule to whole module
-      for i,sub in enumerate(self.imp):     
-         ids = [compUnique.index(kid) for kid in self.sys[sub]['Kname']]
-         self.sys[sub]['I_vec'] = ids
-      num_rows = max(self.sys[self.imp[-1]]['I_vec'])+1
-      for sub in self.imp:          
-         T = BG_model._calcT_(self.sys[sub]['I_vec'],num_rows)
-         self.sys[sub]['T'] = T 
-
-   def _calcT_(I_vec,num_rows):
-    num_cols = len(I_vec)
-    T = np.zeros([num_rows,num_cols])
-    for i in range(num_cols):
-        T[I_vec[i]][i] = 1   
-    return T 
-   
+      # relations between submodule to whole module: row i of the submodule is row I_vec[i] of the whole module
+      compIndex = {comp: i for i, comp in enumerate(compUnique)}
+      for sub in self.imp:     
+         self.sys[sub]['I_vec'] = [compIndex[kid] for kid in self.sys[sub]['Kname']]
+      self.num_rows = len(compUnique)
+
    def write2CellML (self,fpath,unitLib):
       def_import = [CellMLft.indent + f'def import using "{unitLib}" for\n']
       def_model= [f'def model {self.name} as\n']
@@ -486,70 +463,185 @@ class BG_model(object):
          cid.writelines(lines)
       cid.close()  
 
-def updateStoich (model, newz):
-      Nf = []
-      Nr = []
+def updateStoich (model, newz, sparse_output=False):
+      # Scatter the columns of the submodules into the stoichiometric matrices of the whole module, 
+      # the rows of each submodule are mapped by its I_vec, so the matrices are assembled in one pass over the nonzeros
+      # output: N_f, N_r, the dense arrays, or the scipy CSR matrices if sparse_output, without the electric component
+      from scipy import sparse
+      rows_f, cols_f, data_f = [], [], []
+      rows_r, cols_r, data_r = [], [], []
+      num_cols = 0
       for sub in model.sys:
          for z in newz: # update z with value
             model.sys[sub]['N_f'][model.sys[sub]['N_f']==z] == z.value
             model.sys[sub]['N_r'][model.sys[sub]['N_r']==z] == z.value
-         N_f=model.sys[sub]['N_f'].astype(float)
-         N_r=model.sys[sub]['N_r'].astype(float)
-         new_f = np.matmul(model.sys[sub]['T'],N_f)
-         new_r = np.matmul(model.sys[sub]['T'],N_r)
-         if not len(Nf):
-            Nf = new_f
-            Nr = new_r
-         else:
-            Nf = np.append(Nf, new_f,1)
-            Nr = np.append(Nr, new_r,1)
-      N_f = np.delete(Nf, model.eindx, axis=0) 
-      N_r = np.delete(Nr, model.eindx, axis=0)     
+         I_vec = np.asarray(model.sys[sub]['I_vec'], dtype=np.int64)
+         for N, rows, cols, data in [(model.sys[sub]['N_f'], rows_f, cols_f, data_f), (model.sys[sub]['N_r'], rows_r, cols_r, data_r)]:
+            N = np.asarray(N).astype(float)
+            i, j = np.nonzero(N)
+            rows.append(I_vec[i])
+            cols.append(j + num_cols)
+            data.append(N[i, j])
+         num_cols += np.shape(model.sys[sub]['N_f'])[1]
+      # the new index of the rows without the electric component
+      keep = np.ones(model.num_rows, dtype=bool)
+      keep[model.eindx] = False
+      new_row = np.cumsum(keep) - 1
+      shape = (int(keep.sum()), num_cols)
+      matrices = []
+      for rows, cols, data in [(rows_f, cols_f, data_f), (rows_r, cols_r, data_r)]:
+         rows, cols, data = np.concatenate(rows), np.concatenate(cols), np.concatenate(data)
+         mask = keep[rows]
+         N = sparse.csr_matrix((data[mask], (new_row[rows[mask]], cols[mask])), shape=shape)
+         matrices.append(N if sparse_output else N.toarray())
+      N_f, N_r = matrices
       return N_f, N_r            
+# Networks with more reactions and species than this are converted with the sparse least-squares solver instead of the dense pseudo-inverse
+K2BG_SPARSE_SIZE = 2000
+K2BG_LSMR_TOL = 1e-12 # the tolerances atol and btol of lsmr
+K2BG_LSMR_MAXITER = 10 # the iteration limit of lsmr, per column of M
+
+""" Construct M = [I N_f^T; I N_r^T; 0 N_c^T] of the kinetic to BG parameter conversion"""
+def k2BG_matrix(N_f,N_r,N_c=[]):
+   N_fT = np.transpose(_dense(N_f))
+   N_rT = np.transpose(_dense(N_r))
+   num_cols = N_fT.shape[0]
+   I = np.identity(num_cols)
+   blocks = [np.hstack([I, N_fT]), np.hstack([I, N_rT])]
+   if _size(N_c)>0:
+      N_cT = np.transpose(np.asarray(N_c,dtype=float))
+      blocks.append(np.hstack([np.zeros((N_cT.shape[0],num_cols)), N_cT]))
+   return np.vstack(blocks)
+
+""" Construct M as k2BG_matrix in the sparse (CSR) format, N_f, N_r and N_c can be dense or scipy sparse matrices"""
+def k2BG_sparse_matrix(N_f,N_r,N_c=[]):
+   from scipy import sparse
+   N_fT = sparse.csr_matrix(N_f,dtype=float).T
+   N_rT = sparse.csr_matrix(N_r,dtype=float).T
+   I = sparse.identity(N_fT.shape[0],format='csr')
+   blocks = [[I, N_fT], [I, N_rT]]
+   if _size(N_c)>0:
+      blocks.append([None, sparse.csr_matrix(N_c,dtype=float).T])
+   return sparse.bmat(blocks,format='csr')
+
+def _dense(N):
+   return N.toarray().astype(float) if hasattr(N,'toarray') else np.asarray(N,dtype=float)
+
+def _size(N):
+   # the number of entries of a list, array or scipy sparse matrix
+   return np.prod(N.shape) if hasattr(N,'shape') else np.size(N)
+
+class K2BGconverter:
+   # Convert the kinetic parameters to the BG parameters of one network, M and its pseudo-inverse are computed once 
+   # and reused for every parameter set, e.g., in the fitting loops
+   def __init__(self,N_f,N_r,N_c=[],Ws=None,solver=None):
+      # Ws: the volume of the species, 1 if None
+      # solver: 'pinv', the dense pseudo-inverse; 'lsmr', the sparse iterative least squares (scipy.sparse.linalg.lsmr);
+      #         None for 'lsmr' if the network has more than K2BG_SPARSE_SIZE reactions and species, otherwise 'pinv'
+      self.num_cols = N_f.shape[1] if hasattr(N_f,'shape') else len(N_f[0])
+      num_species = N_f.shape[0] if hasattr(N_f,'shape') else len(N_f)
+      if solver is None:
+         solver = 'lsmr' if self.num_cols + num_species > K2BG_SPARSE_SIZE else 'pinv'
+      self.solver = solver
+      Ws = np.ones(num_species) if Ws is None else np.ravel(np.asarray(Ws,dtype=float))
+      self.W = np.append(np.ones(self.num_cols), Ws)
+      if solver == 'pinv':
+         self.M = k2BG_matrix(N_f,N_r,N_c)
+         self.M_pinv = np.linalg.pinv(self.M)
+      elif solver == 'lsmr':
+         self.M = k2BG_sparse_matrix(N_f,N_r,N_c)
+      else:
+         sys.exit(f'The solver {solver} is not defined!')
+
+   """ Convert the rows of kf, kr and K_c, one row per parameter set"""
+   def convert(self,kf,kr,K_c=[]):
+      # input: kf/kr, the arrays (n_sets, n_reactions) of the forward and reverse kinetic rate constants, or vectors for a single set;
+      #        K_c, the array (n_sets, n_constraints) of the known constraints, empty if there are no constraints
+      # output: kappa (n_sets, n_reactions), K (n_sets, n_species), error (n_sets), the sum of the relative residuals of the kinetic constants;
+      #         vectors and a scalar error for a single set
+      # The least-squares residuals ||M*log(lambda) - log(k)|| of the sets are kept in self.residual (n_sets), and self.converged (n_sets)
+      # is False for the sets where lsmr reached its iteration limit, whose BG parameters are approximate
+      single = np.ndim(kf) == 1
+      k_kinetic = [np.atleast_2d(np.asarray(kf,dtype=float)), np.atleast_2d(np.asarray(kr,dtype=float))]
+      if np.size(K_c) > 0:
+         k_kinetic.append(np.atleast_2d(np.asarray(K_c,dtype=float)))
+      k_kinetic = np.hstack(k_kinetic)
+      log_k = np.log(k_kinetic)
+      if self.solver == 'pinv':
+         lambda_expo = log_k @ self.M_pinv.T
+         self.converged = np.ones(len(log_k), dtype=bool)
+      else:
+         # lsmr starting from zero converges to the minimum norm least-squares solution, as the pseudo-inverse
+         from scipy.sparse.linalg import lsmr
+         maxiter = K2BG_LSMR_MAXITER*self.M.shape[1]
+         solutions = [lsmr(self.M, log_k_set, atol=K2BG_LSMR_TOL, btol=K2BG_LSMR_TOL, maxiter=maxiter) for log_k_set in log_k]
+         lambda_expo = np.vstack([solution[0] for solution in solutions])
+         # istop 7: the iteration limit was reached before the tolerances
+         self.converged = np.array([solution[1] != 7 for solution in solutions])
+      self.residual = np.linalg.norm(np.asarray(self.M @ lambda_expo.T).T - log_k, axis=1)
+      if not np.all(self.converged):
+         warnings.warn(f'lsmr did not converge in {maxiter} iterations for {np.sum(~self.converged)} of {len(log_k)} parameter sets, '
+                       f'their BG parameters are approximate (residual up to {np.max(self.residual[~self.converged]):.3g})', RuntimeWarning)
+      lambdak = np.exp(lambda_expo)/self.W
+      k_est = np.exp(np.asarray(self.M @ lambda_expo.T).T)
+      error = np.sum(np.abs((k_kinetic - k_est)/k_kinetic),axis=1)
+      kappa, K = lambdak[:,:self.num_cols], lambdak[:,self.num_cols:]
+      if single:
+         return kappa[0], K[0], error[0]
+      return kappa, K, error
+
+# The converters of the recent networks, {key of N_f, N_r, N_c, Ws: K2BGconverter}
+_CONVERTERS = {}
+_MAX_CONVERTERS = 32
+
+def _array_key(a):
+   if a is None:
+      return None
+   if hasattr(a,'tocsr'): # scipy sparse
+      a = a.tocsr()
+      return (a.shape, a.data.astype(float).tobytes(), a.indices.tobytes(), a.indptr.tobytes())
+   a = np.asarray(a,dtype=float)
+   return (a.shape, a.tobytes())
+
+""" Get the converter of the network, M is only factorized the first time the network is seen"""
+def k2BG_converter(N_f,N_r,N_c=[],Ws=None,solver=None):
+   key = tuple(_array_key(a) for a in [N_f,N_r,N_c,Ws]) + (solver,)
+   if key not in _CONVERTERS:
+      if len(_CONVERTERS) >= _MAX_CONVERTERS:
+         _CONVERTERS.pop(next(iter(_CONVERTERS)))
+      _CONVERTERS[key] = K2BGconverter(N_f,N_r,N_c,Ws,solver)
+   return _CONVERTERS[key]
+
+""" Convert many sets of kinetic parameters of the same network in one vectorized call, see K2BGconverter.convert"""
+def k2BGpara_batch(N_f,N_r,kf,kr,K_c=[],N_c=[],Ws=None,solver=None):
+   return k2BG_converter(N_f,N_r,N_c,Ws,solver).convert(kf,kr,K_c)
+
 # Convert kinetic parameter to BG parameter        
 def k2BGpara(N_f,N_r,kf,kr,K_c,N_c,Ws):
-   # N_f/N_r: forward and reverse stoichiometric matrices
+   # N_f/N_r: forward and reverse stoichiometric matrices, dense or scipy sparse
    # kf/kr: column vectors of the forward and reverse kinetic rate constants; 
    # K_c: column vector of known constraints between the species defined in N_c; 
    # Ws: column vector of the volume of species
-   # Construct M, W, and vector of kinetic paras
-   N_fT = np.transpose(N_f)
-   N_rT = np.transpose(N_r) 
-   N = N_r - N_f
-   num_cols = len(N[0])
-   I = np.identity(num_cols)
-   if len(N_c)>0:
-      N_cT=np.transpose(N_c)
-      zerofill = np.zeros(num_cols)
-      tempM = np.append(np.append(I, N_fT,1), np.append(I, N_rT,1),0)
-      M = np.append(tempM, np.append(zerofill, N_cT,1),0)
-      k_kinetic = kf + kr + K_c
-   else:
-      M = np.append(np.append(I, N_fT,1), np.append(I, N_rT,1),0)
-      k_kinetic = kf + kr
-   W = list(np.append([1]*num_cols, Ws))
-   # Convert kinetic paras to BG paras
-   lambda_expo = np.matmul(np.linalg.pinv(M), [math.log(k) for k in k_kinetic])
-   lambdaW = [math.exp(l) for l in lambda_expo]
-   lambdak = [lambdaW[i]/W[i] for i in range(len(W))]
-   kappa = lambdak[:num_cols]
-   K = lambdak[num_cols:]
+   # M and its pseudo-inverse are reused across the calls for the same network (see k2BG_converter); 
+   # large networks are solved with sparse least squares (see K2BG_SPARSE_SIZE)
+   converter = k2BG_converter(N_f,N_r,N_c,Ws)
+   kappa, K, error = converter.convert(kf, kr, K_c if _size(N_c)>0 else [])
+   kappa, K = kappa.tolist(), K.tolist()
+   if converter.solver != 'pinv':
+      # the checks are skipped for the large networks, whose nullspaces may fill in
+      return kappa, K, error
+   M = converter.M
+   N = _dense(N_r) - _dense(N_f)
    # Checks
-   R = nsimplify(Matrix(N), rational=True).nullspace() #rational_nullspace(N, max_denom=len(N[0]))
-   if R:
-       R = np.transpose(np.array(R).astype(np.float64))[0]
+   R = cycles(N, float)
    # Check that there is a detailed balance constraint
-   Z = nsimplify(Matrix(M), rational=True).nullspace() #rational_nullspace(M, 2)
-   if Z:
-       Z = np.transpose(np.array(Z).astype(np.float64))[0] 
-   k_est = np.matmul(M,[math.log(k) for k in lambdaW])
-   k_est = [math.exp(k) for k in k_est]
-   diff = [(k_kinetic[i] - k_est[i])/k_kinetic[i] for i in range(len(k_kinetic))]
-   error = np.sum([abs(d) for d in diff])
+   Z = nullspace_matrix(M, float)
    K_eq = [kf[i]/kr[i] for i in range(len(kr))]      
    try:
-       zero_est = np.matmul(np.transpose(R),K_eq)
-       zero_est_log = np.matmul(np.transpose(R),[math.log(k) for k in K_eq])
+       if R.shape[1] == 0:
+           raise ValueError('no cycles')
+       zero_est = R.T @ K_eq
+       zero_est_log = R.T @ [math.log(k) for k in K_eq]
    except:
        print('undefined R nullspace')
    return kappa, K, error
@@ -1,12 +1,13 @@
 from libcellml import Component, Generator, GeneratorProfile, Model, Units,  Variable, ImportSource, Printer, Annotator
 import pandas as pd
 from utilities import print_model, ask_for_file_or_folder, ask_for_input, infix_to_mathml
+from mathmlBuilder import sympy_equation, MathAccumulator
 import sys
+import re
+from functools import lru_cache
 import cellml
 from pathlib import PurePath 
 
-MATH_HEADER = '<math xmlns="http://www.w3.org/1998/Math/MathML" xmlns:cellml="http://www.cellml.org/cellml/2.0#">\n'
-MATH_FOOTER = '</math>\n'
 BUILTIN_UNITS = {'ampere':Units.StandardUnit.AMPERE, 'becquerel':Units.StandardUnit.BECQUEREL, 'candela':Units.StandardUnit.CANDELA, 'coulomb':Units.StandardUnit.COULOMB, 'dimensionless':Units.StandardUnit.DIMENSIONLESS, 
                  'farad':Units.StandardUnit.FARAD, 'gram':Units.StandardUnit.GRAM, 'gray':Units.StandardUnit.GRAY, 'henry':Units.StandardUnit.HENRY, 'hertz':Units.StandardUnit.HERTZ, 'joule':Units.StandardUnit.JOULE,
                    'katal':Units.StandardUnit.KATAL, 'kelvin':Units.StandardUnit.KELVIN, 'kilogram':Units.StandardUnit.KILOGRAM, 'liter':Units.StandardUnit.LITRE, 'litre':Units.StandardUnit.LITRE, 
@@ -14,6 +15,15 @@ BUILTIN_UNITS = {'ampere':Units.StandardUnit.AMPERE, 'becquerel':Units.StandardU
                    'ohm':Units.StandardUnit.OHM, 'pascal':Units.StandardUnit.PASCAL, 'radian':Units.StandardUnit.RADIAN, 'second':Units.StandardUnit.SECOND, 'siemens':Units.StandardUnit.SIEMENS, 'sievert':Units.StandardUnit.SIEVERT, 
                    'steradian':Units.StandardUnit.STERADIAN, 'tesla':Units.StandardUnit.TESLA, 'volt':Units.StandardUnit.VOLT, 'watt':Units.StandardUnit.WATT, 'weber':Units.StandardUnit.WEBER}
 
+# The SI prefixes and the symbols of the units in the units names, e.g., fmol_per_sec, J_per_K_per_mol, mM
+SI_PREFIXES = {'Y':'yotta', 'Z':'zetta', 'E':'exa', 'P':'peta', 'T':'tera', 'G':'giga', 'M':'mega', 'k':'kilo', 'h':'hecto', 'da':'deca',
+               'd':'deci', 'c':'centi', 'm':'milli', 'u':'micro', 'n':'nano', 'p':'pico', 'f':'femto', 'a':'atto', 'z':'zepto', 'y':'yocto'}
+# symbol: [(unitName, exponent)], the prefix applies to the first unit
+UNITS_SYMBOLS = {'mol':[('mole',1)], 'sec':[('second',1)], 's':[('second',1)], 'J':[('joule',1)], 'V':[('volt',1)], 'A':[('ampere',1)],
+                 'C':[('coulomb',1)], 'F':[('farad',1)], 'S':[('siemens',1)], 'K':[('kelvin',1)], 'L':[('litre',1)], 'l':[('litre',1)],
+                 'g':[('gram',1)], 'm':[('metre',1)], 'N':[('newton',1)], 'W':[('watt',1)], 'Hz':[('hertz',1)], 'Pa':[('pascal',1)],
+                 'M':[('mole',1), ('litre',-1)]}
+
 def getEntityList(model, comp_name=None):
     # input: model, the CellML model object
     #        comp_name, the CellML component name
@@ -184,7 +194,7 @@ def importCellML(model,imported_model,importSource,import_type, imported_compone
             units_to_import = units_undefined.intersection(existing_units)
         else:
             units_to_import = set()
-        for unit in units_to_import:
+        for unit in sorted(units_to_import): # sorted, so that the file is the same in every run
             u = Units(unit)
             u.setImportSource(importSource)
             u.setImportReference(unit)
@@ -386,8 +396,62 @@ def defineUnits_UI(iunitsName):
     multiplier = ask_for_input(message, 'Text')
     return unitName, prefix, exponent, multiplier
 
-# Define the units
+# Define the units from a list of [unitName, prefix, exponent, multiplier], e.g., [['mole','femto',1,1],['second',1,-1,1]] for fmol_per_sec
+def defineUnits(iunitsName, unit_list):
+    iunits = Units(iunitsName)
+    for unitName, prefix, exponent, multiplier in unit_list:
+        if unitName in BUILTIN_UNITS:
+            iunits.addUnit(BUILTIN_UNITS[unitName], prefix, float(exponent), float(multiplier))
+        else:
+            iunits.addUnit(unitName, prefix, float(exponent), float(multiplier))
+    return iunits
+
+def _parseUnitsSymbol(symbol):
+    # e.g., 'fmol' -> [['mole', 'femto', 1]], 'mM' -> [['mole', 'milli', 1], ['litre', '', -1]], 'second' -> [['second', '', 1]]
+    if symbol in BUILTIN_UNITS:
+        return [[symbol, '', 1]]
+    if symbol in UNITS_SYMBOLS:
+        return [[unitName, '', exponent] for unitName, exponent in UNITS_SYMBOLS[symbol]]
+    for prefix in sorted(SI_PREFIXES, key=len, reverse=True):
+        base = symbol[len(prefix):]
+        if symbol.startswith(prefix) and (base in BUILTIN_UNITS or base in UNITS_SYMBOLS):
+            unit_list = _parseUnitsSymbol(base)
+            unit_list[0][1] = SI_PREFIXES[prefix]
+            return unit_list
+    return None
+
+@lru_cache(maxsize=None)
+def _parseUnitsName(iunitsName):
+    # The units before the first 'per' are the numerator, the ones after are the denominator, e.g., per_sec3_fmol2, J_per_K_per_mol
+    exponents = {} # (unitName, prefix): exponent
+    sign = 1
+    for token in iunitsName.split('_'):
+        if token == 'per':
+            sign = -1
+            continue
+        match = re.fullmatch(r'(.*?)(\d*)', token)
+        unit_list = _parseUnitsSymbol(match.group(1)) if match.group(1) != '' else None
+        if unit_list is None:
+            return None
+        power = int(match.group(2)) if match.group(2) != '' else 1
+        for unitName, prefix, exponent in unit_list:
+            exponents[(unitName, prefix)] = exponents.get((unitName, prefix), 0) + sign*power*exponent
+    if len(exponents) == 0:
+        return None
+    unit_list = tuple((unitName, prefix, exponent, 1) for (unitName, prefix), exponent in exponents.items() if exponent != 0)
+    return unit_list if len(unit_list) > 0 else (('dimensionless', '', 1, 1),)
+
+# Get the list of [unitName, prefix, exponent, multiplier] of defineUnits from the units name, e.g., fmol2_per_sec, per_fmol_sec, mM_per_sec;
+# None if the name does not follow the naming convention of the units (see _units_name in BG2CellML.py)
+def parseUnitsName(iunitsName):
+    unit_list = _parseUnitsName(iunitsName)
+    return None if unit_list is None else [list(unit) for unit in unit_list]
+
+# Define the units, from the units name if possible (see parseUnitsName), otherwise by asking the user
 def _defineUnits(iunitsName):
+    unit_list = parseUnitsName(iunitsName)
+    if unit_list is not None:
+        return defineUnits(iunitsName, unit_list)
     iunits = Units(iunitsName)
     while True:
         unitName, prefix, exponent, multiplier = defineUnits_UI(iunitsName)
@@ -450,14 +514,17 @@ def writeEquations_UI(component):
 
 # Add equations to the model
 def addEquations(component, equations):
-
-    component.setMath(MATH_HEADER)            
+    # input: equations, [(rhs, ode_var, voi)], rhs is an infix string or a SymPy expression, which is converted to MathML directly (see mathmlBuilder.py)
+    math = MathAccumulator()
     for equation in equations:
-        infix = equation[0]
+        rhs = equation[0]
         ode_var = equation[1]
         voi = equation[2]
-        component. appendMath(infix_to_mathml(infix, ode_var, voi))
-    component. appendMath(MATH_FOOTER)
+        if isinstance(rhs, str):
+            math.append(infix_to_mathml(rhs, ode_var, voi))
+        else:
+            math.append(sympy_equation(rhs, ode_var, voi))
+    math.commit(component)
 
 
 def writeCellML_UI(directory, model):
@@ -471,8 +538,9 @@ def writeCellML_UI(directory, model):
     return full_path
 
 # Write a model to cellml file, input: directory, model, output: cellml file
-def writeCellML(full_path, model): 
-    full_path= assignAllIds(full_path,model)    
+# ask: whether to ask the user before assigning the ids, False to assign them without asking (batch mode)
+def writeCellML(full_path, model, ask=True): 
+    full_path= assignAllIds(full_path,model,ask)    
     printer = Printer()
     serialised_model = printer.printModel(model)    
     write_file = open(full_path, "w")
@@ -525,9 +593,12 @@ def editModel(directory,model):
     
 
 """" Assign IDs to all entities in the model; """
-def assignAllIds(fullpath,model):
-    meassage = f'Do you want to assign all the ids to the {model.name()}?'
-    answer = ask_for_input(meassage, 'Confirm', True)
+def assignAllIds(fullpath,model,ask=True):
+    if ask:
+        meassage = f'Do you want to assign all the ids to the {model.name()}?'
+        answer = ask_for_input(meassage, 'Confirm', True)
+    else:
+        answer = True
     if answer:
         directory=str(PurePath(fullpath).parent)
         annotator = Annotator()
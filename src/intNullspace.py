@@ -0,0 +1,183 @@
+# Exact nullspaces of integer (stoichiometric) matrices, e.g., the cycles N*r = 0 and the conserved moieties c*N = 0
+# The rows are sparse {col: int} and are eliminated fraction-free (Gauss-Jordan, each row divided by the gcd of its entries),
+# so the basis is integer and as sparse as the elimination allows. The basis is verified modulo a few primes before it is returned.
+import math
+from fractions import Fraction
+import numpy as np
+from scipy import sparse
+
+# The primes of the modular verification, small enough that the products of the residues fit in int64
+VERIFY_PRIMES = (16777213, 16777199)
+# The sums of A*v are reduced modulo the prime every VERIFY_BLOCK columns, so that the partial sums of the products (< 2^48) fit in int64 too
+VERIFY_BLOCK = (np.iinfo(np.int64).max - max(VERIFY_PRIMES)) // (max(VERIFY_PRIMES) - 1)**2
+MAX_DENOMINATOR = 10**6 # the non-integer entries are taken as the nearest fractions with at most this denominator
+
+def _to_fraction(value):
+    if isinstance(value, (int, np.integer)):
+        return Fraction(int(value))
+    return Fraction(float(value)).limit_denominator(MAX_DENOMINATOR)
+
+def _normalize(row):
+    # Divide the row by the gcd of its entries
+    g = math.gcd(*row.values())
+    if g > 1:
+        for j in row:
+            row[j] //= g
+    return row
+
+""" Convert a matrix to sparse integer rows, each row is scaled by the lcm of the denominators of its entries"""
+def integer_rows(A):
+    # input: A, a dense array, list of lists, sympy Matrix or scipy sparse matrix of integer or rational entries
+    # output: rows, [{col: int}] of the nonzero entries; n_cols, the number of columns
+    if sparse.issparse(A):
+        A = sparse.csr_matrix(A)
+        entries = [zip(A.indices[A.indptr[i]:A.indptr[i+1]], A.data[A.indptr[i]:A.indptr[i+1]]) for i in range(A.shape[0])]
+        n_cols = A.shape[1]
+    else:
+        if hasattr(A, 'tolist'):
+            A = A.tolist()
+        entries = [enumerate(row) for row in A]
+        n_cols = len(A[0]) if len(A) > 0 else 0
+    rows = []
+    for row_entries in entries:
+        row = {int(j): _to_fraction(a) for j, a in row_entries if a != 0}
+        if len(row) == 0:
+            continue
+        den = math.lcm(*[a.denominator for a in row.values()])
+        rows.append(_normalize({j: int(a*den) for j, a in row.items()}))
+    return rows, n_cols
+
+""" Reduce the sparse integer rows to the fraction-free reduced row echelon form"""
+def _reduce(rows):
+    # output: pivots, {pivot col: reduced row}; the pivot col of a reduced row is not in any other reduced row
+    pivots = {}
+    col_rows = {} # {col: the pivot cols of the reduced rows with a nonzero in col}
+    col_count = {} # the number of nonzeros of the cols in the original rows
+    for row in rows:
+        for j in row:
+            col_count[j] = col_count.get(j, 0) + 1
+    # the sparse rows first, as in the Markowitz ordering, to limit the fill-in and the growth of the entries
+    for row in sorted(rows, key=len):
+        row = dict(row)
+        # eliminating a pivot only brings in non-pivot cols, so one pass over the pivots of the row is enough
+        for p in [j for j in row if j in pivots]:
+            a = row.pop(p)
+            prow = pivots[p]
+            b = prow[p]
+            for j in row:
+                row[j] *= b
+            for j, c in prow.items():
+                if j != p:
+                    value = row.get(j, 0) - a*c
+                    if value:
+                        row[j] = value
+                    else:
+                        row.pop(j, None)
+        if len(row) == 0:
+            continue # dependent row
+        _normalize(row)
+        # the pivot with the smallest value and then the fewest nonzeros in the other rows keeps the entries small and sparse
+        c = min(row, key=lambda j: (abs(row[j]), len(col_rows.get(j, ())) + col_count[j], j))
+        a = row[c]
+        for p in list(col_rows.get(c, ())):
+            prow = pivots[p]
+            b = prow.pop(c)
+            for j in prow:
+                prow[j] *= a
+            for j, value in row.items():
+                if j == c:
+                    continue
+                value = prow.get(j, 0) - b*value
+                if value:
+                    if j not in prow:
+                        col_rows.setdefault(j, set()).add(p)
+                    prow[j] = value
+                elif j in prow:
+                    del prow[j]
+                    col_rows[j].discard(p)
+            _normalize(prow)
+            col_rows[c].discard(p)
+        pivots[c] = row
+        for j in row:
+            if j != c:
+                col_rows.setdefault(j, set()).add(c)
+    return pivots
+
+""" Check A*v = 0 modulo the VERIFY_PRIMES"""
+def verify_nullspace(rows, n_cols, basis):
+    # input: rows, [{col: int}] of A; basis, [{col: int}]; output: True if every basis vector is in the nullspace of A
+    if len(rows) == 0 or len(basis) == 0:
+        return True
+    for prime in VERIFY_PRIMES:
+        A = _modular_matrix(rows, len(rows), n_cols, prime).tocsc()
+        V = _modular_matrix(basis, len(basis), n_cols, prime).tocsc()
+        residual = sparse.csr_matrix((len(rows), len(basis)), dtype=np.int64)
+        for start in range(0, n_cols, VERIFY_BLOCK):
+            block = (A[:, start:start+VERIFY_BLOCK] @ V[:, start:start+VERIFY_BLOCK].T).tocsr()
+            block.data %= prime
+            residual = residual + block
+            residual.data %= prime
+        if residual.count_nonzero() > 0:
+            return False
+    return True
+
+def _modular_matrix(rows, n_rows, n_cols, prime):
+    row = [i for i, r in enumerate(rows) for j in r]
+    col = [j for r in rows for j in r]
+    data = [a % prime for r in rows for a in r.values()]
+    return sparse.csr_matrix((np.array(data, dtype=np.int64), (row, col)), shape=(n_rows, n_cols))
+
+""" Integer basis of the right nullspace of A, A*v = 0"""
+def integer_nullspace(A):
+    # input: A, see integer_rows
+    # output: basis, [{col: int}], one vector per free column, sparse and divided by the gcd of its entries;
+    #         the free column of the vector is positive and is zero in the other vectors, so the basis is independent
+    rows, n_cols = integer_rows(A)
+    pivots = _reduce(rows)
+    free_rows = {} # {free col: the pivot cols of the reduced rows with a nonzero in the free col}
+    for p, row in pivots.items():
+        for j in row:
+            if j != p:
+                free_rows.setdefault(j, []).append(p)
+    basis = []
+    for f in range(n_cols):
+        if f in pivots:
+            continue
+        ps = free_rows.get(f, [])
+        scale = math.lcm(*[abs(pivots[p][p]) for p in ps]) if ps else 1
+        v = {f: scale}
+        for p in ps:
+            # row: a_p*x_p + a_f*x_f + ... = 0, x_p = -a_f*x_f/a_p
+            v[p] = -pivots[p][f]*scale//pivots[p][p]
+        basis.append(_normalize(dict(sorted(v.items()))))
+    if not verify_nullspace(rows, n_cols, basis):
+        raise ArithmeticError('The modular verification of the nullspace failed')
+    return basis
+
+""" The basis of integer_nullspace as the columns of a scipy sparse (CSC) matrix"""
+def basis_matrix(basis, n, dtype=np.int64):
+    # input: basis, [{row: int}]; n, the length of the vectors; dtype, np.int64, or float if the entries may not fit in int64
+    row = [i for v in basis for i in v]
+    col = [k for k, v in enumerate(basis) for i in v]
+    data = [a for v in basis for a in v.values()]
+    if np.issubdtype(dtype, np.integer) and any(abs(a) > np.iinfo(dtype).max for a in data):
+        raise OverflowError(f'The nullspace basis does not fit in {np.dtype(dtype).name}')
+    return sparse.csc_matrix((np.array(data, dtype=dtype), (row, col)), shape=(n, len(basis)))
+
+def _shape(A):
+    if hasattr(A, 'shape'):
+        return tuple(A.shape)
+    return (len(A), len(A[0]) if len(A) > 0 else 0)
+
+""" The nullspace of A as the columns of a sparse integer matrix, see integer_nullspace"""
+def nullspace_matrix(A, dtype=np.int64):
+    return basis_matrix(integer_nullspace(A), _shape(A)[1], dtype)
+
+""" The cycles of the stoichiometric matrix N (species x reactions): the reaction vectors r with N*r = 0, as the columns of a sparse integer matrix"""
+def cycles(N, dtype=np.int64):
+    return nullspace_matrix(N, dtype)
+
+""" The conserved moieties of the stoichiometric matrix N: the species vectors c with c*N = 0, as the columns of a sparse integer matrix"""
+def conserved_moieties(N, dtype=np.int64):
+    N_T = N.T if hasattr(N, 'T') else list(map(list, zip(*N)))
+    return nullspace_matrix(N_T, dtype)
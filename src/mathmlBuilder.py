@@ -0,0 +1,138 @@
+# Build the CellML 2.0 MathML of the equations directly, without the infix parse and print round trip of libsbml (see infix_to_mathml in utilities.py)
+# The nodes of the expression tree are the MathML strings of the subexpressions, e.g., times(ci('R'), ci('T'), ln(ci('q_A'))),
+# so an equation is serialized while it is built. The numbers carry the cellml:units annotation required by CellML 2.0
+from sympy import S, Pow, Rational, exp, log, sin, cos, tan, sinh, cosh, tanh, Abs
+
+MATH_HEADER = '<math xmlns="http://www.w3.org/1998/Math/MathML" xmlns:cellml="http://www.cellml.org/cellml/2.0#">\n'
+MATH_FOOTER = '</math>\n'
+
+class MathAccumulator:
+    # Collect the MathML of the equations of a component and set them with a single setMath,
+    # instead of appendMath per equation, which copies the growing math string of the component each time
+    def __init__(self):
+        self.fragments = []
+
+    def append(self, mathml):
+        self.fragments.append(mathml)
+
+    """ Set the collected equations as the math of the component"""
+    def commit(self, component):
+        component.setMath(MATH_HEADER + ''.join(self.fragments) + MATH_FOOTER)
+
+""" A variable"""
+def ci(name):
+    return f'<ci>{name}</ci>'
+
+""" A number with its units, the numbers with an exponent, e.g., 2.5e-17, are written in e-notation"""
+def cn(value, units='dimensionless'):
+    # CellML only accepts the real numbers without an exponent, the e-notation splits the mantissa and the exponent with <sep/>
+    text = repr(value) if isinstance(value, float) else str(value)
+    mantissa, e, exponent = text.lower().partition('e')
+    if e:
+        return f'<cn cellml:units="{units}" type="e-notation">{mantissa}<sep/>{exponent}</cn>'
+    return f'<cn cellml:units="{units}">{text}</cn>'
+
+""" Apply the MathML operator op, e.g., 'plus', 'times', 'exp', to the arguments"""
+def apply(op, *args):
+    return f'<apply><{op}/>{"".join(args)}</apply>'
+
+def plus(*args):
+    return args[0] if len(args) == 1 else apply('plus', *args)
+
+def times(*args):
+    return args[0] if len(args) == 1 else apply('times', *args)
+
+def minus(*args):
+    return apply('minus', *args)
+
+def divide(num, den):
+    return apply('divide', num, den)
+
+def ln(arg):
+    return apply('ln', arg)
+
+def exponential(arg):
+    return apply('exp', arg)
+
+""" The sum of the signed terms, e.g., [(-1, a), (1, b)] -> b - a, 0 if there are no terms"""
+def signed_sum(terms):
+    pos = [term for sign, term in terms if sign > 0]
+    neg = [term for sign, term in terms if sign < 0]
+    if len(neg) == 0:
+        return plus(*pos) if pos else cn(0)
+    if len(pos) == 0:
+        return minus(plus(*neg))
+    return minus(plus(*pos), plus(*neg))
+
+""" The equation ode_var = rhs, or d(ode_var)/d(voi) = rhs if voi is given"""
+def equation(rhs, ode_var, voi=''):
+    if voi != '':
+        lhs = f'<apply><diff/><bvar><ci>{voi}</ci></bvar><ci>{ode_var}</ci></apply>'
+    else:
+        lhs = ci(ode_var)
+    return f'<apply><eq/>{lhs}{rhs}</apply>\n'
+
+# The SymPy functions and their MathML operators
+SYMPY_FUNCTIONS = {exp: 'exp', log: 'ln', sin: 'sin', cos: 'cos', tan: 'tan', sinh: 'sinh', cosh: 'cosh', tanh: 'tanh', Abs: 'abs'}
+
+def _number(value):
+    # input: value, a SymPy number; output: the MathML of the number, fractions are divisions
+    if value.is_Integer:
+        return cn(int(value))
+    if value.is_Rational:
+        return divide(cn(int(value.p)), cn(int(value.q)))
+    if value.is_Float and value.is_finite:
+        return cn(float(value))
+    raise ValueError(f'The number {value} is not supported')
+
+def _mul(expr):
+    # The factors with negative exponents are the denominator
+    num = []
+    den = []
+    for factor in expr.args:
+        if factor.is_Pow and factor.exp.is_Number and factor.exp < 0:
+            den.append(sympy_to_mathml(factor.base) if factor.exp == -1 else sympy_to_mathml(Pow(factor.base, -factor.exp)))
+        elif factor.is_Rational and not factor.is_Integer:
+            if factor.p != 1:
+                num.append(cn(int(factor.p)))
+            den.append(cn(int(factor.q)))
+        else:
+            num.append(sympy_to_mathml(factor))
+    num = times(*num) if num else cn(1)
+    return divide(num, times(*den)) if den else num
+
+""" Convert a SymPy expression to MathML"""
+def sympy_to_mathml(expr):
+    if expr.is_Symbol:
+        return ci(expr.name)
+    if expr is S.Exp1:
+        return '<exponentiale/>'
+    if expr.is_Number:
+        if expr.is_negative:
+            return minus(_number(-expr))
+        return _number(expr)
+    if expr.is_Add:
+        terms = []
+        for term in expr.args:
+            if term.could_extract_minus_sign():
+                terms.append((-1, sympy_to_mathml(-term)))
+            else:
+                terms.append((1, sympy_to_mathml(term)))
+        return signed_sum(terms)
+    if expr.is_Mul:
+        if expr.could_extract_minus_sign():
+            return minus(sympy_to_mathml(-expr))
+        return _mul(expr)
+    if expr.is_Pow:
+        if expr.exp.is_Number and expr.exp < 0:
+            return divide(cn(1), sympy_to_mathml(expr.base) if expr.exp == -1 else sympy_to_mathml(Pow(expr.base, -expr.exp)))
+        if expr.exp == Rational(1, 2):
+            return apply('root', sympy_to_mathml(expr.base))
+        return apply('power', sympy_to_mathml(expr.base), sympy_to_mathml(expr.exp))
+    if expr.func in SYMPY_FUNCTIONS:
+        return apply(SYMPY_FUNCTIONS[expr.func], *[sympy_to_mathml(arg) for arg in expr.args])
+    raise ValueError(f'{expr.func} is not supported in the MathML of CellML')
+
+""" The equation ode_var = expr (SymPy), see equation"""
+def sympy_equation(expr, ode_var, voi=''):
+    return equation(sympy_to_mathml(expr), ode_var, voi)
@@ -0,0 +1,111 @@
+# Binary cache of the parsed stoichiometric csv files (see load_sparse_matrix in sparseStoich.py)
+# Each network is a directory of .npy files loaded with memory mapping, so loading a cached network does not copy the matrices.
+# The cache is reused while the modification time and size, or else the content hash, of both csv files are unchanged.
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+from sparseStoich import SparseStoich, load_sparse_matrix
+
+NETWORK_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.bg2cellml', 'network_cache')
+NETWORK_CACHE_VERSION = 1 # bump when the layout changes, so that the old entries are not reused
+_NAMES = ['CompName', 'CompType', 'ReName', 'ReType']
+_ARRAYS = ['row', 'col', 'cells', 'data', 'indptr']
+
+def _file_stat(path):
+    stat = os.stat(path)
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+def _file_hash(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def _entry_dir(fmatrix, rmatrix, cache_dir):
+    key = json.dumps([os.path.abspath(fmatrix), os.path.abspath(rmatrix)])
+    return os.path.join(cache_dir, hashlib.sha256(key.encode()).hexdigest())
+
+""" Load the network from the cache, None if it is not cached or the csv files have changed"""
+def load_network(fmatrix, rmatrix, cache_dir=NETWORK_CACHE_DIR):
+    # output: CompName, CompType, ReName, ReType, N_f, N_r (SparseStoich) as load_sparse_matrix
+    entry = _entry_dir(fmatrix, rmatrix, cache_dir)
+    try:
+        with open(os.path.join(entry, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('version') != NETWORK_CACHE_VERSION:
+        return None
+    sources = meta['sources']
+    for path, source in zip([fmatrix, rmatrix], sources):
+        stat = _file_stat(path)
+        if stat['size'] != source['size']:
+            return None
+        if stat['mtime_ns'] != source['mtime_ns']:
+            # touched but maybe not changed, compare the content
+            if _file_hash(path) != source['sha256']:
+                return None
+            source.update(stat)
+            try:
+                _write_meta(entry, meta)
+            except OSError:
+                pass
+    try:
+        names = [np.load(os.path.join(entry, name + '.npy')).tolist() for name in _NAMES]
+        matrices = []
+        for suffix in ['f', 'r']:
+            arrays = [np.load(os.path.join(entry, f'{name}_{suffix}.npy'), mmap_mode='r') for name in _ARRAYS]
+            symbolic = {(i, j): (z, unit) for i, j, z, unit in meta['symbolic_' + suffix]}
+            matrices.append(SparseStoich.from_arrays(tuple(meta['shape']), *arrays, symbolic))
+    except (OSError, ValueError):
+        return None
+    return (*names, *matrices)
+
+def _write_meta(entry, meta):
+    fd, tmp_path = tempfile.mkstemp(dir=entry, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, os.path.join(entry, 'meta.json'))
+
+""" Save the network to the cache"""
+def save_network(fmatrix, rmatrix, network, cache_dir=NETWORK_CACHE_DIR):
+    CompName, CompType, ReName, ReType, N_f, N_r = network
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write to a temporary directory first, so that concurrent runs never read a partial entry
+    tmp_dir = tempfile.mkdtemp(dir=cache_dir, suffix='.tmp')
+    for name, values in zip(_NAMES, [CompName, CompType, ReName, ReType]):
+        np.save(os.path.join(tmp_dir, name + '.npy'), np.array(values, dtype=str))
+    meta = {'version': NETWORK_CACHE_VERSION, 'shape': list(N_f.shape),
+            'sources': [{**_file_stat(path), 'sha256': _file_hash(path)} for path in [fmatrix, rmatrix]]}
+    for suffix, N in [('f', N_f), ('r', N_r)]:
+        # the cells are stored as fixed width strings, which can be memory mapped
+        arrays = [N.row, N.col, np.array(N.cells, dtype=str), N.data, N.indptr]
+        for name, values in zip(_ARRAYS, arrays):
+            np.save(os.path.join(tmp_dir, f'{name}_{suffix}.npy'), values)
+        meta['symbolic_' + suffix] = [[i, j, z, unit] for (i, j), (z, unit) in N.symbolic.items()]
+    _write_meta(tmp_dir, meta)
+    entry = _entry_dir(fmatrix, rmatrix, cache_dir)
+    shutil.rmtree(entry, ignore_errors=True)
+    try:
+        os.replace(tmp_dir, entry)
+    except OSError: # another run has written the entry
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+""" Read the stoichiometric matrices, from the cache if the csv files are unchanged"""
+def load_matrix_cached(fmatrix, rmatrix, cache_dir=NETWORK_CACHE_DIR):
+    # input: cache_dir, None to disable the cache
+    # output: CompName, CompType, ReName, ReType, N_f, N_r (SparseStoich) as load_sparse_matrix
+    if cache_dir is None:
+        return load_sparse_matrix(fmatrix, rmatrix)
+    network = load_network(fmatrix, rmatrix, cache_dir)
+    if network is None:
+        network = load_sparse_matrix(fmatrix, rmatrix)
+        try:
+            save_network(fmatrix, rmatrix, network, cache_dir)
+        except OSError as e: # e.g., a read-only home directory
+            print(f'The network is not cached: {e}')
+    return network
@@ -0,0 +1,141 @@
+# Fraction-free (Bareiss) elimination for sparse symbolic linear systems
+# The entries are converted to sparse multivariate polynomials (PolyElement) so that
+# every intermediate entry is a minor of the original matrix and no rational functions are formed.
+from collections import Counter
+from sympy import Matrix, parallel_poly_from_expr
+from sympy.polys.rings import ring
+
+""" Convert a list of expressions to elements of a common polynomial ring"""
+def exprs_to_ring(exprs):
+    # input: exprs, a list of sympy expressions
+    # output: R, the polynomial ring; elements, [PolyElement] in the order of exprs
+    # Non-polynomial subexpressions such as exp(F*V_m/(R*T)) are taken as generators of the ring
+    polys, opt = parallel_poly_from_expr(exprs)
+    R, *_ = ring(opt.gens, opt.domain)
+    return R, [R.from_dict(p.rep.to_dict()) for p in polys]
+
+""" Convert the entries of a sympy matrix and a vector to elements of a common polynomial ring"""
+def to_ring(M, b):
+    # input: M, the sympy matrix; b, the right hand side vector
+    # output: R, the polynomial ring; rows, [{col: PolyElement}] of the nonzero entries of M; rhs, [PolyElement] of b
+    R, elements = exprs_to_ring(list(M) + list(b))
+    n_cols = M.shape[1]
+    rows = [{j: a for j, a in enumerate(elements[i*n_cols:(i+1)*n_cols]) if a} for i in range(M.shape[0])]
+    rhs = elements[M.shape[0]*n_cols:]
+    return R, rows, rhs
+
+""" Pack sparse polynomial rows into plain dictionaries, e.g., to send them to another process"""
+def pack_rows(R, rows):
+    # PolyElement cannot be pickled, the ring is rebuilt from its symbols and domain by unpack_rows
+    return R.symbols, R.domain, [{j: dict(a) for j, a in row.items()} for row in rows]
+
+def unpack_rows(symbols, domain, rows):
+    R, *_ = ring(symbols, domain)
+    return R, [{j: R.from_dict(a) for j, a in row.items()} for row in rows]
+
+""" Choose the pivot with the Markowitz criterion to reduce the fill-in"""
+def _markowitz_pivot(rows, active_rows):
+    # The cost of pivot (i,j) is (r_i-1)*(c_j-1), r_i and c_j are the number of nonzeros of row i and column j;
+    # ties are broken by the number of terms of the pivot to keep the multipliers small
+    col_count = Counter(j for i in active_rows for j in rows[i])
+    best = None
+    for i in active_rows:
+        for j, a in rows[i].items():
+            cost = ((len(rows[i])-1)*(col_count[j]-1), len(a), i, j)
+            if best is None or cost < best:
+                best = cost
+    if best is None:
+        return None
+    return best[2], best[3]
+
+""" Bareiss elimination of the sparse rows (in place)"""
+def _eliminate(R, rows, rhs=None):
+    # output: pivots, [(row, col)] in the elimination order, None if the matrix is singular;
+    #         the last pivot is the determinant of the matrix permuted to the pivot order
+    active_rows = set(range(len(rows)))
+    pivots = []
+    prev = R.one
+    for k in range(len(rows)):
+        pivot = _markowitz_pivot(rows, active_rows)
+        if pivot is None:
+            return None
+        pi, pj = pivot
+        p = rows[pi][pj]
+        active_rows.remove(pi)
+        for i in active_rows:
+            # Bareiss step: a_ij = (p*a_ij - a_ik*a_kj)/prev, the division is exact
+            a_ik = rows[i].pop(pj, None)
+            new = {}
+            if a_ik is None:
+                for j, a in rows[i].items():
+                    new[j] = (p*a).exquo(prev)
+                if rhs is not None:
+                    rhs[i] = (p*rhs[i]).exquo(prev)
+            else:
+                for j in (set(rows[i]) | set(rows[pi])) - {pj}:
+                    a = p*rows[i].get(j, R.zero) - a_ik*rows[pi].get(j, R.zero)
+                    if a:
+                        new[j] = a.exquo(prev)
+                if rhs is not None:
+                    rhs[i] = (p*rhs[i] - a_ik*rhs[pi]).exquo(prev)
+            rows[i] = new
+        pivots.append((pi, pj))
+        prev = p
+    return pivots
+
+def _permutation_sign(perm):
+    sign = 1
+    seen = set()
+    for start in range(len(perm)):
+        length = 0
+        k = start
+        while k not in seen:
+            seen.add(k)
+            k = perm[k]
+            length += 1
+        if length > 0 and length % 2 == 0:
+            sign = -sign
+    return sign
+
+""" Determinant of a square matrix given as sparse polynomial rows"""
+def det_fraction_free(R, rows):
+    # input: R, the polynomial ring; rows, [{col: PolyElement}], the columns are any sortable keys
+    # output: the determinant as a PolyElement
+    if len(rows) == 0:
+        return R.one
+    cols = sorted(set(j for row in rows for j in row))
+    if len(cols) < len(rows):
+        return R.zero
+    rows = [dict(row) for row in rows]
+    pivots = _eliminate(R, rows)
+    if pivots is None:
+        return R.zero
+    col_position = {j: k for k, j in enumerate(cols)}
+    sign = _permutation_sign([pi for pi, pj in pivots])*_permutation_sign([col_position[pj] for pi, pj in pivots])
+    pi, pj = pivots[-1]
+    return sign*rows[pi][pj]
+
+""" Solve M*x = b by fraction-free elimination with fill-reducing pivoting"""
+def solve_fraction_free(M, b):
+    # input: M, the square sympy matrix with polynomial (or exp) entries; b, the right hand side vector
+    # output: x_num, the sympy matrix of the numerators; x_den, the common denominator (det(M) up to sign), x = x_num/x_den
+    if M.shape[0] != M.shape[1] or M.shape[0] != len(b):
+        raise ValueError('Matrix must be square and match the right hand side.')
+    R, rows, rhs = to_ring(M, b)
+    n = M.shape[0]
+    pivots = _eliminate(R, rows, rhs)
+    if pivots is None:
+        raise ValueError('Matrix det == 0; not invertible.')
+    # The last pivot is the determinant of the permuted matrix; back substitute with y = det*x, which are polynomials (Cramer's rule)
+    pi, pj = pivots[-1]
+    det = rows[pi][pj]
+    y = {}
+    for pi, pj in reversed(pivots):
+        acc = det*rhs[pi]
+        for j, a in rows[pi].items():
+            if j != pj:
+                acc -= a*y[j]
+        y[pj] = acc.exquo(rows[pi][pj])
+    x_num = Matrix([y[j].as_expr() for j in range(n)])
+    x_den = det.as_expr()
+    return x_num, x_den
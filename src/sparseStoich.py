@@ -0,0 +1,155 @@
+# Sparse stoichiometric matrices read from the forward and reverse csv files (see load_matrix in utilities.py)
+# Only the nonzero cells are kept, numeric cells as floats and the z/unit cells in a separate table of symbolic entries
+import csv
+import sys
+import numpy as np
+
+class SparseStoich:
+    # Stoichiometric matrix in the coordinate (COO) format, the nonzeros are sorted by row and then by column
+    def __init__(self, shape, row, col, cells):
+        # attribute: shape, (number of species, number of reactions); row, col, the int arrays of the indexes of the nonzeros;
+        # cells, the object array of the original strings of the nonzeros, e.g., '1', '2', 'z_Na/dimensionless';
+        # data, the float array of the nonzeros, nan for the symbolic entries;
+        # symbolic, {(i,j): (z, unit)} of the cells z/unit or of the symbols z (unit '')
+        self.shape = shape
+        self.row = np.asarray(row, dtype=np.int64)
+        self.col = np.asarray(col, dtype=np.int64)
+        self.cells = np.asarray(cells, dtype=object)
+        self.symbolic = {}
+        try:
+            self.data = self.cells.astype(float) # all the cells are numeric
+            return self._index()
+        except ValueError:
+            self.data = np.full(len(self.cells), np.nan)
+        for k, cell in enumerate(self.cells):
+            if '/' in cell:
+                z, unit = cell.split('/', 1)
+            else:
+                z, unit = cell, ''
+            try:
+                value = float(z)
+            except ValueError:
+                value = np.nan
+            if unit != '' or np.isnan(value):
+                self.symbolic[(int(self.row[k]), int(self.col[k]))] = (z, unit)
+            self.data[k] = value
+        self._index()
+
+    def _index(self):
+        # the compressed row (CSR) index: the nonzeros of row i are indptr[i]:indptr[i+1]
+        self.indptr = np.concatenate(([0], np.cumsum(np.bincount(self.row, minlength=self.shape[0]))))
+
+    """ Rebuild the sparse matrix from its arrays without parsing the cells again, e.g., from the network cache"""
+    @staticmethod
+    def from_arrays(shape, row, col, cells, data, indptr, symbolic):
+        N = SparseStoich.__new__(SparseStoich)
+        N.shape = shape
+        N.row, N.col, N.cells, N.data, N.indptr = row, col, cells, data, indptr
+        N.symbolic = symbolic
+        return N
+
+    @property
+    def nnz(self):
+        return len(self.cells)
+
+    """ The column indexes and cells of the nonzeros of row i"""
+    def row_nonzeros(self, i):
+        return self.col[self.indptr[i]:self.indptr[i+1]], self.cells[self.indptr[i]:self.indptr[i+1]]
+
+    """ The row indexes and cells of the nonzeros of column j"""
+    def col_nonzeros(self, j):
+        if not hasattr(self, '_col_order'):
+            self._col_order = np.lexsort((self.row, self.col))
+            self._col_indptr = np.concatenate(([0], np.cumsum(np.bincount(self.col, minlength=self.shape[1]))))
+        index = self._col_order[self._col_indptr[j]:self._col_indptr[j+1]]
+        return self.row[index], self.cells[index]
+
+    """ The scipy CSR matrix of the numeric values, the symbolic entries are nan"""
+    def tocsr(self):
+        from scipy.sparse import csr_matrix
+        return csr_matrix((self.data, self.col, self.indptr), shape=self.shape)
+
+    """ The dense array of strings as returned by the row-by-row reader, '0' for the zeros"""
+    def todense(self):
+        width = max([1] + [len(cell) for cell in self.cells])
+        N = np.full(self.shape, '0', dtype=f'<U{width}')
+        N[self.row, self.col] = self.cells
+        return N
+
+""" Convert a dense array of strings (load_matrix) to a sparse matrix, a sparse matrix is returned as it is"""
+def to_sparse(N):
+    if isinstance(N, SparseStoich):
+        return N
+    N = np.asarray(N)
+    row, col = np.nonzero(N != '0')
+    return SparseStoich(N.shape, row, col, N[row, col].astype(object))
+
+def _split_nonzero(line):
+    # Split a csv line (bytes) into the cells, only the nonzero cells after the first two columns are decoded
+    # output: the first two cells, the number of the other cells, the column indexes and strings of the nonzeros, whether a cell is empty
+    if b'"' in line: # quoted cells, fall back to the csv reader
+        row = next(csv.reader([line.decode()]))
+        entries = np.array(row[2:])
+        nonzero = np.flatnonzero(entries != '0')
+        return row[:2], len(entries), nonzero, entries[nonzero].astype(object), (entries == '').any()
+    buf = np.frombuffer(line, dtype=np.uint8)
+    bounds = np.flatnonzero(buf == ord(','))
+    starts = np.concatenate(([0], bounds + 1))
+    ends = np.concatenate((bounds, [len(buf)]))
+    names = [line[starts[k]:ends[k]].decode() for k in range(min(2, len(starts)))]
+    starts, ends = starts[2:], ends[2:]
+    lengths = ends - starts
+    first = buf[np.minimum(starts, len(buf) - 1)] if len(buf) > 0 else np.zeros(len(starts), dtype=np.uint8)
+    nonzero = np.flatnonzero((lengths != 1) | (first != ord('0')))
+    cells = np.array([line[starts[k]:ends[k]].decode() for k in nonzero], dtype=object)
+    return names, len(starts), nonzero, cells, (lengths == 0).any()
+
+def _read_stoich(fmatrix, startR=2, startC=2):
+    # Read the csv file line by line, the cells of a line are split with vectorized passes and only the nonzero cells are kept
+    # output: ReType, ReName, CompType, CompName, SparseStoich
+    rows = []
+    cols = []
+    cells = []
+    CompName = []
+    CompType = []
+    with open(fmatrix, 'rb') as f:
+        header = [next(csv.reader([f.readline().decode()]), []) for k in range(startR)]
+        ReType, ReName = header[0][startC:], header[1][startC:]
+        i = 0
+        for line in f:
+            line = line.rstrip(b'\r\n')
+            if len(line) == 0:
+                continue
+            names, n_cells, nonzero, nonzero_cells, empty = _split_nonzero(line)
+            if n_cells != len(ReName) or empty:
+                sys.exit('There are duplicate components or empty stoichiometry')
+            CompType.append(names[startC-2])
+            CompName.append(names[startC-1])
+            rows.append(np.full(len(nonzero), i))
+            cols.append(nonzero)
+            cells.append(nonzero_cells)
+            i += 1
+    nnz = np.concatenate(cols) if cols else np.array([], dtype=np.int64)
+    N = SparseStoich((len(CompName), len(ReName)), np.concatenate(rows) if rows else nnz, nnz,
+                     np.concatenate(cells) if cells else np.array([], dtype=object))
+    # Cells such as '0.0' are zeros too
+    zero = N.data == 0
+    if zero.any():
+        N = SparseStoich(N.shape, N.row[~zero], N.col[~zero], N.cells[~zero])
+    return ReType, ReName, CompType, CompName, N
+
+def _has_duplicates(names):
+    return len(names) > 0 and (np.unique(np.asarray(names), return_counts=True)[1] > 1).any()
+
+""" Read the stoichiometric matrices as sparse matrices"""
+def load_sparse_matrix(fmatrix, rmatrix):
+    # * * ReType ReType
+    # * * ReName ReName
+    # CompType CompName 0 1
+    # CompType CompName 1 0
+    # output: CompName, CompType, ReName, ReType, N_f, N_r (SparseStoich)
+    ReType, ReName, CompType, CompName, N_f = _read_stoich(fmatrix)
+    ReType_r, ReName_r, CompType_r, CompName_r, N_r = _read_stoich(rmatrix)
+    if N_r.shape != N_f.shape or _has_duplicates(CompName) or _has_duplicates(ReName):
+        sys.exit('There are duplicate components or empty stoichiometry')
+    return CompName, CompType, ReName, ReType, N_f, N_r
@@ -0,0 +1,77 @@
+# Content-addressed on-disk cache of the simplified steady state expressions (v_ss, P, Q)
+# The key is a hash of the stoichiometry and of the options of the derivation, e.g., the simplification budget,
+# so regenerating the CellML models of an unchanged network skips the symbolic derivation.
+import hashlib
+import json
+import os
+import tempfile
+from sympy import Symbol, srepr, sympify
+
+SS_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.bg2cellml', 'ss_cache')
+SS_CACHE_MAX_BYTES = 256 * 1024**2 # the least recently used entries are evicted beyond this size
+SS_CACHE_VERSION = 3 # bump when the derivation changes, so that the old entries are not reused
+
+def _canonical_cell(cell):
+    # '1', '1.0' and ' 1' are the same stoichiometry
+    cell = str(cell).strip()
+    try:
+        return repr(float(cell))
+    except ValueError:
+        return cell
+
+""" Get the canonical hash of the stoichiometry and of the options of the derivation"""
+def stoich_key(CompName,CompType,ReName,ReType,N_f,N_r,options={}):
+    # input: options, the json serializable options which change the derived expressions, e.g., {'budget': SIMPLIFY_BUDGET}
+    content = {'version': SS_CACHE_VERSION, 'options': options,
+               'CompName': list(CompName), 'CompType': list(CompType),
+               'ReName': list(ReName), 'ReType': list(ReType),
+               'N_f': [[_canonical_cell(cell) for cell in row] for row in N_f],
+               'N_r': [[_canonical_cell(cell) for cell in row] for row in N_r]}
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+""" Load v_ss, P, Q from the cache, None if the key is not cached"""
+def load_ss(key, cache_dir=SS_CACHE_DIR):
+    path = os.path.join(cache_dir, key + '.json')
+    try:
+        with open(path, 'r') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    os.utime(path) # mark as recently used
+    v_ss = sympify(entry['v_ss'])
+    P = {Symbol(name): (sympify(expr), unit) for name, expr, unit in entry['P']}
+    Q = {Symbol(name): (sympify(expr), unit) for name, expr, unit in entry['Q']}
+    return v_ss, P, Q
+
+""" Save v_ss, P, Q to the cache and evict the least recently used entries"""
+def save_ss(key, v_ss, P, Q, cache_dir=SS_CACHE_DIR, max_bytes=SS_CACHE_MAX_BYTES):
+    entry = {'v_ss': srepr(v_ss),
+             'P': [[p.name, srepr(P[p][0]), P[p][1]] for p in P],
+             'Q': [[q.name, srepr(Q[q][0]), Q[q][1]] for q in Q]}
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write to a temporary file first, so that concurrent runs never read a partial entry
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(entry, f)
+    os.replace(tmp_path, os.path.join(cache_dir, key + '.json'))
+    evict(cache_dir, max_bytes)
+
+""" Remove the least recently used entries until the cache is within max_bytes"""
+def evict(cache_dir=SS_CACHE_DIR, max_bytes=SS_CACHE_MAX_BYTES):
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.json'):
+            try:
+                stat = os.stat(os.path.join(cache_dir, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+    total = sum(entry[1] for entry in entries)
+    for mtime, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except OSError:
+            pass
+        total -= size
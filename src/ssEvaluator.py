@@ -0,0 +1,26 @@
+# Compile the simplified steady state flux into a vectorized NumPy function for parameter sweeps
+import numpy as np
+from sympy import lambdify
+
+""" Compile v_ss and the definitions of P into a vectorized function"""
+def compile_flux_ss(v_ss, P, defaults={}):
+    # input: v_ss, P, the outputs of simplify_flux_ss (BG2CellML)
+    #        defaults, {name: value} used when a symbol is not given, e.g., {c: BG.const[c][0] for c in BG.const}
+    # output: v_ss_func(**values), values maps each symbol name (kappa_*, K_*, q_*, E, V_m, F, R, T) to a scalar or an array;
+    #         the arrays are broadcast against each other and the flux array of the broadcast shape is returned.
+    #         v_ss_func.names lists the symbol names it takes
+    # The P definitions are substituted into v_ss, and lambdify with cse evaluates the shared products of kappa and K only once
+    expr = v_ss.xreplace({p: P[p][0] for p in P})
+    symbols_ = sorted(expr.free_symbols, key=lambda s: s.name)
+    names = [s.name for s in symbols_]
+    func = lambdify(symbols_, expr, modules='numpy', cse=True)
+    def v_ss_func(**values):
+        values = {**defaults, **values}
+        missing = [name for name in names if name not in values]
+        if missing:
+            raise ValueError(f'Missing values of {missing}')
+        args = [np.asarray(values[name], dtype=float) for name in names]
+        shape = np.broadcast(*args).shape if len(args) > 0 else ()
+        return np.broadcast_to(func(*args), shape)
+    v_ss_func.names = names
+    return v_ss_func
@@ -1,6 +1,6 @@
 import numpy as np
 from sympy import *
-from scipy.linalg import null_space
+from intNullspace import cycles, integer_nullspace
 import sympy as sym
 init_printing(use_unicode=True)
 x, y, z = symbols("x y z")
@@ -11,13 +11,12 @@ newexpr=expr.subs(replacements)
 a=factor(x**3 - x**2 + x - 1)
 
 N = np.array([[-1, 1],[1, -1]])
-K = null_space(N)
+K = cycles(N)
 N = np.array([[-1, 1, 0, 0],[1, -1, -1, 1],[0, 0, 1, -1]])
-K = null_space(N)
-cycle=len(K[0,:])
+K = cycles(N)
+cycle=K.shape[1]
 M = Matrix([[-1, 1, 0, 0],[1, -1, -1, 1],[0, 0, 1, -1]])
-M.nullspace()
-pprint(M.nullspace(), use_unicode=True)
+pprint(integer_nullspace(M), use_unicode=True)
 #-4*x**3 - 2*x + y**4 + 4*y**2 + 3
 N_cd=Matrix([[1, 0, -1, 0],[0, -1, 1, 0],[-1, 0, 0, 1],[0, 1, 0, -1]])
 kappa_1, kappa_2, kappa_3, kappa_4 = symbols("kappa_1 kappa_2 kappa_3 kappa_4")
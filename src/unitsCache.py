@@ -0,0 +1,101 @@
+# Process-wide cache of the parsed units models (units libraries) imported by the generated models
+# A units library is parsed once per process and reused while its modification time and size are unchanged.
+# New units are written back only when some were actually added, under a file lock so that concurrent batch jobs do not lose each other's units.
+import contextlib
+import hashlib
+import os
+import tempfile
+from libcellml import Printer
+import cellml
+from build_CellMLV2 import assignAllIds
+try:
+    import fcntl
+except ImportError: # not available on Windows, where the units library is written without a lock
+    fcntl = None
+
+# The lock files of the units libraries, kept out of the folders of the units libraries
+UNITS_LOCK_DIR = os.path.join(os.path.expanduser('~'), '.bg2cellml', 'units_locks')
+
+# {absolute path: UnitsLibrary}
+_LIBRARIES = {}
+
+def _file_stat(path):
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+@contextlib.contextmanager
+def _file_lock(path):
+    # Exclusive lock on a lock file in UNITS_LOCK_DIR, named by the hash of the absolute path of the units library
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(UNITS_LOCK_DIR, exist_ok=True)
+    lock_path = os.path.join(UNITS_LOCK_DIR, hashlib.sha256(os.path.abspath(path).encode()).hexdigest() + '.lock')
+    with open(lock_path, 'a') as lock:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+class UnitsLibrary:
+    # A parsed units model with the index {name: Units} of its units
+    def __init__(self, path, strict_mode=True):
+        self.path = os.path.abspath(path)
+        self.strict_mode = strict_mode
+        self._parse()
+
+    def _parse(self):
+        self.stat = _file_stat(self.path)
+        self.model = cellml.parse_model(self.path, self.strict_mode)
+        self.units = {self.model.units(unit_numb).name(): self.model.units(unit_numb) for unit_numb in range(self.model.unitsCount())}
+
+    """ Parse the units library again if the file has changed since it was parsed"""
+    def refresh(self):
+        if _file_stat(self.path) != self.stat:
+            self._parse()
+
+    """ The names of the units defined in the units library"""
+    def names(self):
+        return set(self.units)
+
+    def __contains__(self, name):
+        return name in self.units
+
+    """ Add the units which are not defined yet and write the units library, only if some units were added"""
+    def add_units(self, new_units, ask=False):
+        # input: new_units, [Units]; ask, whether to ask the user before assigning the ids, see assignAllIds
+        # output: the names of the added units
+        with _file_lock(self.path):
+            # another process may have added units since the library was parsed
+            self.refresh()
+            added = []
+            for units in new_units:
+                if units.name() not in self.units:
+                    self.model.addUnits(units)
+                    self.units[units.name()] = units
+                    added.append(units.name())
+            if len(added) > 0:
+                self._write(ask)
+        return added
+
+    def _write(self, ask):
+        # Write to a temporary file first, so that the other processes never parse a partial units library
+        assignAllIds(self.path, self.model, ask)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(Printer().printModel(self.model))
+        os.chmod(tmp_path, os.stat(self.path).st_mode & 0o777)
+        os.replace(tmp_path, self.path)
+        self.stat = _file_stat(self.path)
+        print('CellML model saved to:', self.path)
+
+""" Get the units library of the path, parsed once per process and again only if the file has changed"""
+def load_units_library(path, strict_mode=True):
+    key = os.path.abspath(path)
+    library = _LIBRARIES.get(key)
+    if library is None or library.strict_mode != strict_mode:
+        library = _LIBRARIES[key] = UnitsLibrary(key, strict_mode)
+    else:
+        library.refresh()
+    return library
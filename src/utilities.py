@@ -5,9 +5,7 @@ import tkinter as tk
 from tkinter import filedialog
 import inquirer
 import sys
-import csv
-import numpy as np
-import libsbml
+from sparseStoich import load_sparse_matrix
 
 """An interactive utility to ask the user to select a file or folder."""
 def ask_for_file_or_folder(message, is_folder=False):
@@ -62,7 +60,9 @@ def ask_for_input(message, type ='Confirm', choices = []):
     else:
         sys.exit(f'Input type {type} is not defined!')
 # Define a function to convert a infix expression to a MathML string (temporary solution with limitations 1. no support for units 2. some MathML elements defined in CellML2.0 are not supported)
+# Only used for the equations typed by the user, the generated equations are built directly by mathmlBuilder.py
 def infix_to_mathml(infix, ode_var, voi=''):
+    import libsbml
     if voi!='':
         preforumla = '<apply> \n <eq/> <apply> <diff/> <bvar> <ci>'+ voi + '</ci> </bvar> <ci>' + ode_var + '</ci> </apply> \n'
     else:
@@ -83,42 +83,9 @@ def load_matrix(fmatrix,rmatrix):
     # * * ReName ReName
     # CompType CompName 0 1 
     # CompType CompName 1 0
-    startR=2
-    startC=2
-    N_f = []
-    N_r = []
-    CompName=[]
-    CompType=[]
-    with open(fmatrix,'r') as f:
-        reader = csv.reader(f,delimiter=',')
-        line_count = 0
-        for row in reader:
-            if line_count ==startR-2:
-                ReType=row[startC:]
-                line_count += 1
-            elif line_count ==startR-1:
-                ReName=[s for s in row[startC:]]
-                line_count += 1
-            else:
-                N_f.append(row[startC:])
-                CompName.append(row[startC-1])
-                CompType.append(row[startC-2])
-        f.close()
-    with open(rmatrix,'r') as f:
-        reader = csv.reader(f,delimiter=',')
-        line_count = 0
-        for row in reader:
-            if line_count <startR:                
-                line_count += 1            
-            else:
-                N_r.append(row[startC:])
-        f.close()
-    
-    # Check duplicate component names and empty stoichiometry before return
-    if len(list(set(CompName)))<len(CompName) or len(list(set(ReName)))<len(ReName) or any(cell == '' for row in N_f for cell in row) or any(cell == '' for row in N_r for cell in row):
-        sys.exit('There are duplicate components or empty stoichiometry') 
-    else:
-        return CompName,CompType,ReName,ReType,np.array(N_f),np.array(N_r)
+    # output: the dense arrays of strings N_f, N_r; see load_sparse_matrix (sparseStoich.py) for the sparse matrices
+    CompName,CompType,ReName,ReType,N_f,N_r=load_sparse_matrix(fmatrix,rmatrix)
+    return CompName,CompType,ReName,ReType,N_f.todense(),N_r.todense()
 
 def print_model(model, include_maths=False):
 
@@ -0,0 +1,49 @@
+import os
+import sys
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src'))
+import numpy as np
+from sympy import cancel, expand
+from BG2CellML import flux_ss, flux_ss_diagram
+
+def multicycle(n, n_cycles=2):
+    # The n-state cycle E1 -> ... -> En -> E1 where Ao binds at r1 and Ai is released at r(n/2+1),
+    # with n_cycles-1 extra reactions E1 -> E(2k+1), as multicycle in benchmark/networks.py
+    CompName = [f'E{i+1}' for i in range(n)] + ['Ao', 'Ai']
+    CompType = ['Ce']*n + ['Se', 'Se']
+    n_reactions = n + n_cycles - 1
+    ReName = [f'r{j+1}' for j in range(n_reactions)]
+    ReType = ['Re']*n_reactions
+    N_f = np.zeros((n+2, n_reactions), dtype=int)
+    N_r = np.zeros((n+2, n_reactions), dtype=int)
+    N_f[n, 0] = 1
+    N_r[n+1, n//2] = 1
+    for j in range(n):
+        N_f[j, j] = 1
+        N_r[(j+1) % n, j] = 1
+    for k in range(1, n_cycles):
+        N_f[0, n+k-1] = 1
+        N_r[(2*k) % n, n+k-1] = 1
+    return CompName, CompType, ReName, ReType, N_f.astype(str), N_r.astype(str)
+
+def _same_flux(flux_1, flux_2):
+    num_1, den_1 = flux_1
+    num_2, den_2 = flux_2
+    return expand(num_1*den_2 - num_2*den_1) == 0
+
+def test_multicycle_solvers_agree():
+    # more reactions than chemodynamic species
+    network = multicycle(3)
+    lu = flux_ss(*network, solver='LU')
+    fraction_free = flux_ss(*network, solver='fraction_free')
+    assert _same_flux(lu, fraction_free)
+
+def test_multicycle_diagram_agrees():
+    network = multicycle(4, 3)
+    fraction_free = flux_ss(*network, solver='fraction_free')
+    diagram = [poly.as_expr() for poly in flux_ss_diagram(*network)]
+    assert cancel(fraction_free[0]/fraction_free[1] - diagram[0]/diagram[1]) == 0
+
+if __name__ == "__main__":
+    test_multicycle_solvers_agree()
+    test_multicycle_diagram_agrees()
+    print('All the tests passed')
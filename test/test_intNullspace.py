@@ -0,0 +1,57 @@
+import os
+import sys
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src'))
+import numpy as np
+from sympy import Matrix, Rational
+from intNullspace import VERIFY_PRIMES, VERIFY_BLOCK, integer_nullspace, nullspace_matrix, cycles, conserved_moieties, verify_nullspace
+
+MATRICES = [
+    [[1, -1, 0, 0], [0, 1, -1, 0], [-1, 0, 1, 0]], # a 3-cycle and a free column
+    [[2, 4, -2], [1, 2, -1], [3, 6, -3]], # rank 1
+    [[1, 2, 3], [4, 5, 6], [7, 8, 10]], # full rank
+    [[Rational(1, 2), Rational(-1, 3), 0], [0, 1, -1]], # rational entries
+    [[0, 0, 0], [0, 0, 0]], # zero
+]
+
+def test_rank_and_nullspace_against_sympy():
+    for A in MATRICES:
+        n_cols = len(A[0])
+        basis = integer_nullspace(A)
+        assert n_cols - len(basis) == Matrix(A).rank(), A
+        for v in basis:
+            vector = Matrix([v.get(j, 0) for j in range(n_cols)])
+            assert Matrix(A)*vector == Matrix.zeros(len(A), 1), A
+            assert all(isinstance(a, int) for a in v.values())
+
+def test_random_integer_matrices_against_sympy():
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        A = rng.integers(-3, 4, size=(rng.integers(1, 7), rng.integers(1, 9)))
+        A[:, rng.random(A.shape[1]) < 0.3] = 0
+        N = nullspace_matrix(A)
+        assert N.shape == (A.shape[1], A.shape[1] - Matrix(A).rank())
+        assert not np.any(A @ N.toarray())
+
+def test_cycles_and_conserved_moieties():
+    # the enzyme cycle E1 -> E2 -> E3 -> E1: one cycle and one conserved moiety, E1 + E2 + E3
+    N = np.array([[-1, 0, 1], [1, -1, 0], [0, 1, -1]])
+    assert cycles(N).toarray().ravel().tolist() == [1, 1, 1]
+    assert conserved_moieties(N).toarray().ravel().tolist() == [1, 1, 1]
+
+def test_verification_of_dense_rows():
+    # more than VERIFY_BLOCK products of residues near prime**2, whose plain int64 sum overflows
+    # (p-1)*1 - 1*(p-1) = 0 for each pair of columns, while the residues of the products are p-1 and (p-1)**2
+    prime = max(VERIFY_PRIMES)
+    n_cols = 4*VERIFY_BLOCK
+    rows = [{j: prime - 1 if j % 2 == 0 else -1 for j in range(n_cols)}]
+    v = {j: 1 if j % 2 == 0 else prime - 1 for j in range(n_cols)}
+    assert verify_nullspace(rows, n_cols, [v])
+    v[0] += 1
+    assert not verify_nullspace(rows, n_cols, [v])
+
+if __name__ == "__main__":
+    test_rank_and_nullspace_against_sympy()
+    test_random_integer_matrices_against_sympy()
+    test_cycles_and_conserved_moieties()
+    test_verification_of_dense_rows()
+    print('All the tests passed')
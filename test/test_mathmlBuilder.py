@@ -0,0 +1,40 @@
+import os
+import sys
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src'))
+from libcellml import Component, Model, Units, Validator, Variable
+from sympy import Float
+import mathmlBuilder as mml
+
+def _validation_issues(rhs):
+    # The issues of a model with the single equation x = rhs
+    model = Model('numbers')
+    component = Component('numbers')
+    model.addComponent(component)
+    x = Variable('x')
+    x.setUnits(Units('dimensionless'))
+    component.addVariable(x)
+    math = mml.MathAccumulator()
+    math.append(mml.equation(rhs, 'x'))
+    math.commit(component)
+    validator = Validator()
+    validator.validateModel(model)
+    return [validator.issue(i).description() for i in range(validator.issueCount())]
+
+def test_float_numbers_are_valid():
+    for value in [2.7755575615628914e-17, 6.02214076e+23, -0.125, -3.5e-09, 1.5]:
+        assert _validation_issues(mml.sympy_to_mathml(Float(value))) == [], value
+
+def test_e_notation():
+    assert mml.cn(2.5e-17) == '<cn cellml:units="dimensionless" type="e-notation">2.5<sep/>-17</cn>'
+    assert mml.cn('1E3', 'fmol') == '<cn cellml:units="fmol" type="e-notation">1<sep/>3</cn>'
+    assert mml.cn(0.5) == '<cn cellml:units="dimensionless">0.5</cn>'
+
+def test_stoichiometric_numbers_are_valid():
+    # the numbers of the stoichiometric csv files are written as they are, see _bond_term in BG2CellML.py
+    assert _validation_issues(mml.times(mml.cn('1e-3'), mml.cn('2'))) == []
+
+if __name__ == "__main__":
+    test_float_numbers_are_valid()
+    test_e_notation()
+    test_stoichiometric_numbers_are_valid()
+    print('All the tests passed')
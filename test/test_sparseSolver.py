@@ -0,0 +1,52 @@
+import os
+import sys
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src'))
+from sympy import Matrix, cancel, exp, expand, symbols
+from sparseSolver import to_ring, det_fraction_free, solve_fraction_free, pack_rows, unpack_rows
+
+a, b, c, d, x = symbols('a b c d x')
+
+MATRICES = [
+    Matrix([[a, b], [c, d]]),
+    Matrix([[0, a, 0], [b, 0, c], [0, d, x]]), # a zero on the diagonal, pivoting is needed
+    Matrix([[a, 0, 0, b], [0, c, d, 0], [0, x, a, 0], [1, 0, 0, exp(x)]]),
+    Matrix([[2, 4, 1], [1, 3, 5], [7, 1, x]]), # integers with a symbol, the ring needs one
+    Matrix([[a, b], [2*a, 2*b]]), # singular
+]
+
+def test_det_against_sympy():
+    for M in MATRICES:
+        R, rows, rhs = to_ring(M, [])
+        assert expand(det_fraction_free(R, rows).as_expr() - M.det()) == 0, M
+
+def test_det_of_fewer_columns_than_rows():
+    R, rows, rhs = to_ring(Matrix([[a, 0], [b, 0], [c, 0]]), [])
+    assert det_fraction_free(R, rows) == R.zero
+
+def test_solve_against_sympy():
+    for M in MATRICES[:-1]:
+        rhs = Matrix([x] + [0]*(M.shape[0]-1))
+        x_num, x_den = solve_fraction_free(M, rhs)
+        expected = M.LUsolve(rhs)
+        for i in range(M.shape[0]):
+            assert cancel(x_num[i]/x_den - expected[i]) == 0, M
+
+def test_solve_singular():
+    try:
+        solve_fraction_free(MATRICES[-1], Matrix([1, 0]))
+    except ValueError:
+        return
+    assert False, 'the singular matrix was solved'
+
+def test_pack_rows():
+    R, rows, rhs = to_ring(MATRICES[2], [])
+    R2, rows2 = unpack_rows(*pack_rows(R, rows))
+    assert [{j: p.as_expr() for j, p in row.items()} for row in rows2] == [{j: p.as_expr() for j, p in row.items()} for row in rows]
+
+if __name__ == "__main__":
+    test_det_against_sympy()
+    test_det_of_fewer_columns_than_rows()
+    test_solve_against_sympy()
+    test_solve_singular()
+    test_pack_rows()
+    print('All the tests passed')